@@ -0,0 +1,452 @@
+"""Benchmarks for the GreenPark API.
+
+Drives the real FastAPI app in-process over httpx's ASGI transport. By
+default the database is mongomock-motor (pip install mongomock-motor);
+pass --mongo to run against the MongoDB at MONGO_URL instead. mongomock
+scans every collection linearly, so use --mongo for 100k-scale loads.
+
+    python bench.py booking --clients 100
+    python bench.py login --clients 200
+    python bench.py serialize --docs 1000
+    python bench.py sensor-storage --readings 200000 --sensor-interval 60
+    python bench.py pricing --price-spots 1000000 --lots 1000
+    python bench.py load --users 100000 --bookings 100000 --mongo --baseline bench_baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'greenpark_bench')
+
+import httpx
+import uvicorn
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import server
+
+
+def quantiles(samples: list) -> dict:
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def percentiles(samples: list) -> str:
+    q = quantiles(samples)
+    return f"p50={q['p50_ms']:.1f}ms p95={q['p95_ms']:.1f}ms p99={q['p99_ms']:.1f}ms"
+
+
+def use_database(real_mongo: bool):
+    if real_mongo:
+        server.connect_db()
+        server.db = server.client[os.environ['DB_NAME'] + '_bench']
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        server.db = AsyncMongoMockClient()['greenpark_bench']
+
+
+def api_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench")
+
+
+async def reset():
+    for name in await server.db.list_collection_names():
+        await server.db[name].drop()
+    await server.ensure_indexes()
+
+
+async def make_users(count: int) -> list:
+    """Insert users with live sessions, return their auth headers"""
+    now = datetime.now(timezone.utc)
+    users, sessions, rewards = [], [], []
+    for i in range(count):
+        user_id = str(uuid.uuid4())
+        token = f"bench_{user_id}"
+        users.append({"id": user_id, "email": f"user{i}@bench.local", "name": f"User {i}", "created_at": now.isoformat()})
+        sessions.append({"user_id": user_id, "session_token": token, "expires_at": now + timedelta(days=1), "created_at": now.isoformat()})
+        rewards.append({"user_id": user_id, "points": 0, "level": "Eco Starter", "carbon_saved": 0.0, "badges": [], "monthly_carbon": []})
+    await server.db.users.insert_many(users)
+    await server.db.user_sessions.insert_many(sessions)
+    await server.db.rewards.insert_many(rewards)
+    return [{"Authorization": f"Bearer {s['session_token']}"} for s in sessions]
+
+
+async def make_spots(count: int, lot_id: str = "lot_001") -> list:
+    spots = [
+        {
+            "id": str(uuid.uuid4()),
+            "lot_id": lot_id,
+            "slot_number": f"A{i+1}",
+            "status": "available",
+            "ev_charging": i % 3 == 0,
+            "location": {"lat": 28.6139, "lng": 77.2090},
+            "rate_per_hour": 40
+        }
+        for i in range(count)
+    ]
+    await server.db.spots.insert_many(spots)
+    return [s['id'] for s in spots]
+
+
+# ============ BOOKING ============
+
+async def bench_booking(args) -> bool:
+    await reset()
+    headers = await make_users(args.clients)
+
+    # Contended: every client races for the same spot
+    [spot_id] = await make_spots(1)
+    async with api_client() as client:
+        responses = await asyncio.gather(*[
+            client.post("/api/bookings", json={"spot_id": spot_id, "duration_hours": 1}, headers=h)
+            for h in headers
+        ])
+    winners = sum(1 for r in responses if r.status_code == 200)
+    stored = await server.db.bookings.count_documents({"spot_id": spot_id})
+    print(f"contended: {args.clients} clients -> {winners} winner(s), {stored} booking(s) stored")
+
+    # Uncontended: one spot per client
+    spot_ids = await make_spots(args.clients)
+    async with api_client() as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/api/bookings", json={"spot_id": s, "duration_hours": 1}, headers=h)
+            for s, h in zip(spot_ids, headers)
+        ])
+        elapsed = time.perf_counter() - started
+    ok = sum(1 for r in responses if r.status_code == 200)
+    print(f"uncontended: {ok}/{len(spot_ids)} booked in {elapsed:.3f}s ({ok / elapsed:.0f} bookings/s)")
+
+    return winners == 1 and stored == 1 and ok == len(spot_ids)
+
+
+# ============ LOGIN BURST ============
+
+def auth_stub(latency: float):
+    """Minimal ASGI stand-in for the Emergent session-data endpoint"""
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        session_id = dict(scope['headers']).get(b'x-session-id', b'').decode()
+        await asyncio.sleep(latency)
+        body = (
+            '{"id":"%s","email":"%s@bench.local","name":"Bench","session_token":"tok_%s"}'
+            % (session_id, session_id, session_id)
+        ).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+class UnpooledAuthUpstream(server.AuthUpstream):
+    """The previous behaviour: a fresh client, and connection, per login"""
+
+    async def fetch_session_data(self, session_id: str) -> dict:
+        async with httpx.AsyncClient() as client:
+            resp = await client.get(self.url, headers={"X-Session-ID": session_id})
+        return resp.json()
+
+
+async def login_burst(clients: int) -> list:
+    async def login(i):
+        started = time.perf_counter()
+        resp = await client.post("/api/auth/session-data", headers={"X-Session-ID": f"{uuid.uuid4().hex}"})
+        assert resp.status_code == 200, resp.text
+        return time.perf_counter() - started
+
+    async with api_client() as client:
+        return await asyncio.gather(*[login(i) for i in range(clients)])
+
+
+async def bench_login(args) -> bool:
+    config = uvicorn.Config(auth_stub(args.stub_latency), host="127.0.0.1", port=args.stub_port, log_level="warning")
+    stub = uvicorn.Server(config)
+    stub_task = asyncio.create_task(stub.serve())
+    while not stub.started:
+        await asyncio.sleep(0.01)
+
+    url = f"http://127.0.0.1:{args.stub_port}/auth/v1/env/oauth/session-data"
+    original = server.auth_upstream
+    try:
+        for label, upstream in (
+            ("per-request client", UnpooledAuthUpstream(url)),
+            ("pooled client", server.AuthUpstream(url, max_concurrency=original.max_concurrency)),
+        ):
+            await reset()
+            server.auth_upstream = upstream
+            await login_burst(10)  # warm up
+            started = time.perf_counter()
+            samples = await login_burst(args.clients)
+            elapsed = time.perf_counter() - started
+            print(f"{label}: {args.clients} logins in {elapsed:.3f}s, {percentiles(samples)}")
+            await upstream.close()
+    finally:
+        server.auth_upstream = original
+        stub.should_exit = True
+        await stub_task
+    return True
+
+
+# ============ SERIALIZATION ============
+
+def sample_history(docs: int) -> tuple:
+    now = datetime.now(timezone.utc)
+    spots = [
+        {"id": str(uuid.uuid4()), "lot_id": "lot_001", "slot_number": f"A{i+1}", "status": "available",
+         "ev_charging": i % 3 == 0, "location": {"lat": 28.6139, "lng": 77.2090}, "rate_per_hour": 40}
+        for i in range(docs)
+    ]
+    history = [
+        {
+            "booking": {"id": str(uuid.uuid4()), "user_id": "u", "spot_id": spot['id'], "start_time": now.isoformat(),
+                        "end_time": now.isoformat(), "duration_hours": 2.0, "amount": 80.0, "status": "active",
+                        "ev_charging": False, "created_at": now.isoformat()},
+            "spot": spot,
+            "transaction": {"id": str(uuid.uuid4()), "user_id": "u", "booking_id": "b", "amount": 80.0,
+                            "payment_method": "razorpay", "razorpay_order_id": "order_mock", "status": "completed",
+                            "created_at": now.isoformat()}
+        }
+        for spot in spots
+    ]
+    return spots, history
+
+
+def per_doc_cost(encode, payload, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        encode(payload)
+    return (time.perf_counter() - started) / rounds / len(payload) * 1e6
+
+
+async def bench_serialize(args) -> bool:
+    spots, history = sample_history(args.docs)
+    paths = (
+        ("stdlib (jsonable_encoder + JSONResponse)", lambda p: JSONResponse(jsonable_encoder(p)).body),
+        ("orjson (dump_json)", server.dump_json),
+    )
+    for endpoint, payload in (("/api/spots", spots), ("/api/history", history)):
+        for label, encode in paths:
+            print(f"{endpoint} {label}: {per_doc_cost(encode, payload, args.rounds):.2f}us/doc")
+    return True
+
+
+# ============ LOAD ============
+
+async def seed_volume(spot_count: int, user_count: int, booking_count: int, batch: int = 5000) -> list:
+    """seed_data-style generators at realistic volume; returns user auth headers"""
+    headers = []
+    for offset in range(0, user_count, batch):
+        headers += await make_users(min(batch, user_count - offset))
+    user_ids = [h['Authorization'][len("Bearer bench_"):] for h in headers]
+    await server.db.rewards.bulk_write([
+        server.UpdateOne({"user_id": user_id}, {"$set": {"points": random.randint(0, 800)}}) for user_id in user_ids
+    ])
+
+    spot_ids = []
+    for lot in range(0, spot_count, 500):
+        spot_ids += await make_spots(min(500, spot_count - lot), lot_id=f"lot_{lot // 500 + 1:03d}")
+    await server.db.spots.update_many({}, {"$set": {"status": "occupied"}})
+
+    now = datetime.now(timezone.utc)
+    for offset in range(0, booking_count, batch):
+        bookings, transactions = [], []
+        for i in range(offset, min(offset + batch, booking_count)):
+            start = now - timedelta(minutes=i)
+            booking = server.Booking(
+                user_id=random.choice(user_ids), spot_id=random.choice(spot_ids), start_time=start,
+                end_time=start + timedelta(hours=2), duration_hours=2, amount=80, status="completed", created_at=start
+            )
+            bookings.append(server.to_document(booking))
+            transactions.append(server.to_document(server.Transaction(
+                user_id=booking.user_id, booking_id=booking.id, amount=80, payment_method="razorpay",
+                razorpay_order_id=f"order_mock_{i}", status="completed", created_at=start
+            )))
+        await server.db.bookings.insert_many(bookings)
+        await server.db.transactions.insert_many(transactions)
+    return headers
+
+
+async def drive(client: httpx.AsyncClient, make_request, requests: int, clients: int) -> dict:
+    """Fire `requests` calls from `clients` concurrent workers"""
+    samples, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            resp = await make_request(client, i)
+            samples.append(time.perf_counter() - started)
+            if resp.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(clients)])
+    elapsed = time.perf_counter() - started
+    return {**quantiles(samples), "rps": len(samples) / elapsed, "errors": errors}
+
+
+async def bench_load(args) -> bool:
+    await reset()
+    print(f"seeding {args.spots} spots, {args.users} users, {args.bookings} bookings/transactions...")
+    headers = await seed_volume(args.spots, args.users, args.bookings)
+    free_spots = await make_spots(args.requests, lot_id="lot_bench")
+
+    scenarios = {
+        "get_current_user": lambda c, i: c.get("/api/auth/me", headers=random.choice(headers)),
+        "/history": lambda c, i: c.get("/api/history", headers=random.choice(headers)),
+        "/leaderboard": lambda c, i: c.get("/api/rewards/leaderboard"),
+        "/spots": lambda c, i: c.get("/api/spots"),
+        "create_booking": lambda c, i: c.post(
+            "/api/bookings", json={"spot_id": free_spots[i], "duration_hours": 1}, headers=random.choice(headers)
+        ),
+    }
+
+    results = {}
+    async with api_client() as client:
+        for name, make_request in scenarios.items():
+            results[name] = result = await drive(client, make_request, args.requests, args.clients)
+            print(
+                f"{name:<18} p50={result['p50_ms']:7.1f}ms p95={result['p95_ms']:7.1f}ms "
+                f"p99={result['p99_ms']:7.1f}ms {result['rps']:8.0f} req/s errors={result['errors']}"
+            )
+
+    ok = all(r['errors'] == 0 for r in results.values())
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name, result in results.items():
+            limit = baseline.get(name, {}).get('p95_ms')
+            if limit is not None and result['p95_ms'] > limit * (1 + args.tolerance):
+                print(f"REGRESSION {name}: p95 {result['p95_ms']:.1f}ms > {limit:.1f}ms +{args.tolerance:.0%}")
+                ok = False
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    return ok
+
+
+# ============ SENSOR STORAGE ============
+
+async def bench_sensor_storage(args) -> bool:
+    """BSON bytes for the same readings as one document each vs hourly buckets"""
+    import bson
+    spots = [str(uuid.uuid4()) for _ in range(args.spots)]
+    lot_of = {spot_id: f"lot_{i % 10:03d}" for i, spot_id in enumerate(spots)}
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    step = timedelta(seconds=args.sensor_interval)
+    readings = [
+        {"spot_id": spots[i % args.spots], "status": random.choice(sorted(server.SENSOR_STATUSES)),
+         "timestamp": (start + step * (i // args.spots)).isoformat()}
+        for i in range(args.readings)
+    ]
+    raw_bytes = sum(len(bson.encode({"_id": bson.ObjectId(), **r})) for r in readings)
+
+    # The documents bucket_writes upserts, built directly: mongomock upserts are too slow at this size
+    buckets = [
+        {"_id": bson.ObjectId(), "spot_id": spot_id, "hour": hour, "lot_id": lot_of[spot_id], "n": len(packed), "r": packed}
+        for (spot_id, hour), packed in server.bucket_readings(readings).items()
+    ]
+    bucket_bytes = sum(len(bson.encode(b)) for b in buckets)
+
+    print(f"{args.readings} readings from {args.spots} spots ({args.readings / len(buckets):.0f} per spot-hour on average)")
+    print(f"one document per reading: {raw_bytes / 1e6:.2f} MB")
+    print(f"hourly buckets ({len(buckets)} docs): {bucket_bytes / 1e6:.2f} MB ({raw_bytes / bucket_bytes:.1f}x smaller)")
+    return bucket_bytes < raw_bytes
+
+
+# ============ PRICING ============
+
+def synthetic_lots(lots: int) -> list:
+    lot_stats = []
+    for i in range(lots):
+        total = random.randint(20, 2000)
+        lot_stats.append({"lot_id": f"lot_{i:04d}", "total": total, "available": random.randint(0, total)})
+    return lot_stats
+
+
+async def bench_pricing(args) -> bool:
+    """Time full repricing passes over an in-memory catalog; no DB involved"""
+    rng = server.np.random.default_rng(0)
+    lot_ids = [f"lot_{i:04d}" for i in range(args.lots)]
+    lot_of = rng.integers(0, args.lots, args.price_spots)
+    rates = rng.choice([30, 40, 50, 60], args.price_spots)
+    spots = [
+        {"id": f"spot_{i}", "lot_id": lot_ids[lot], "rate_per_hour": float(rate)}
+        for i, (lot, rate) in enumerate(zip(lot_of.tolist(), rates.tolist()))
+    ]
+
+    started = time.perf_counter()
+    server.pricing.load_catalog(spots)
+    print(f"catalog: {args.price_spots} spots in {args.lots} lots loaded in {time.perf_counter() - started:.2f}s")
+
+    # Train the forecaster on synthetic counts so passes include forecast lookups
+    for lot_id in lot_ids:
+        total = rng.integers(0, 50, server.WEEK_SLOTS)
+        server.forecaster._counts[lot_id] = server.np.stack([rng.integers(0, total + 1), total])
+    server.forecaster._rebuild()
+
+    samples = []
+    for _ in range(args.rounds):
+        lot_stats = synthetic_lots(args.lots)
+        started = time.perf_counter()
+        server.pricing.reprice(lot_stats)
+        samples.append(time.perf_counter() - started)
+
+    worst = max(samples)
+    print(f"reprice pass: {percentiles(samples)} max={worst * 1000:.1f}ms")
+    print(f"refresh interval: {args.interval:.1f}s ({worst / args.interval:.2%} used by the slowest pass)")
+    return worst < args.interval
+
+
+BENCHMARKS = {
+    "booking": bench_booking,
+    "login": bench_login,
+    "serialize": bench_serialize,
+    "load": bench_load,
+    "pricing": bench_pricing,
+    "sensor-storage": bench_sensor_storage,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--mongo", action="store_true", help="use the MongoDB at MONGO_URL instead of mongomock")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--stub-port", type=int, default=8099, help="login: port for the local auth stub")
+    parser.add_argument("--spots", type=int, default=2000, help="load/sensor-storage: spots to seed")
+    parser.add_argument("--users", type=int, default=5000, help="load: users to seed")
+    parser.add_argument("--bookings", type=int, default=20000, help="load: bookings (and transactions) to seed")
+    parser.add_argument("--requests", type=int, default=500, help="load: requests per endpoint")
+    parser.add_argument("--baseline", help="load: fail if any p95 exceeds this saved baseline")
+    parser.add_argument("--save-baseline", help="load: write this run's results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="load: allowed p95 regression over baseline")
+    parser.add_argument("--docs", type=int, default=1000, help="serialize: documents per payload")
+    parser.add_argument("--rounds", type=int, default=20, help="serialize: encodes per measurement; pricing: passes")
+    parser.add_argument("--readings", type=int, default=200_000, help="sensor-storage: readings to store")
+    parser.add_argument("--sensor-interval", type=float, default=60, help="sensor-storage: seconds between a spot's readings")
+    parser.add_argument("--price-spots", type=int, default=1_000_000, help="pricing: spots in the catalog")
+    parser.add_argument("--lots", type=int, default=1000, help="pricing: lots the spots are spread over")
+    parser.add_argument("--interval", type=float, default=server.PRICING_INTERVAL,
+                        help="pricing: refresh interval a pass must fit in (seconds)")
+    parser.add_argument("--stub-latency", type=float, default=0.02, help="login: stub response delay in seconds")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    use_database(args.mongo)
+    ok = asyncio.run(BENCHMARKS[args.benchmark](args))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie, Query, Depends
+from fastapi.responses import StreamingResponse, ORJSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, ReplaceOne, monitoring
+from pymongo.errors import OperationFailure, DuplicateKeyError, AutoReconnect
 import os
 import logging
 from pathlib import Path
@@ -11,16 +14,174 @@ import uuid
 from datetime import datetime, timezone, timedelta
 import httpx
 import random
+import time
+import orjson
+import asyncio
+import hashlib
+import hmac
+import base64
+import math
+import importlib.util
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# ============ METRICS ============
+
+class RequestStats:
+    """Mongo round-trips attributed to one in-flight request"""
+
+    def __init__(self):
+        self.commands = 0
+        self.db_seconds = 0.0
+        self.docs_returned = 0
+        self.by_command = {}  # (collection, command) -> count
+        self._lock = threading.Lock()
+
+    def record(self, collection: str, command: str, seconds: float, docs: int):
+        # Motor runs commands on executor threads
+        with self._lock:
+            self.commands += 1
+            self.db_seconds += seconds
+            self.docs_returned += docs
+            key = (collection, command)
+            self.by_command[key] = self.by_command.get(key, 0) + 1
+
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar('current_request_stats', default=None)
+
+class MongoCommandMonitor(monitoring.CommandListener):
+    """Attributes each Mongo command to the request in the current context"""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        if current_request_stats.get() is not None:
+            collection = event.command.get(event.command_name)
+            self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        stats = current_request_stats.get()
+        if stats is None:
+            return
+        reply = event.reply
+        cursor = reply.get('cursor', {})
+        docs = len(cursor.get('firstBatch', cursor.get('nextBatch', []))) if cursor else reply.get('n', 0)
+        stats.record(self._collections.pop(event.request_id, ""), event.command_name, event.duration_micros / 1e6, docs)
+
+    def failed(self, event):
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.record(self._collections.pop(event.request_id, ""), event.command_name, event.duration_micros / 1e6, 0)
+
+class Histogram:
+    """Prometheus histogram keyed by a tuple of label values"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, label_values: tuple, value: float):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, label_values: tuple, amount: int = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+REQUEST_SECONDS = Histogram(
+    "greenpark_request_duration_seconds", "Request latency by route",
+    ("method", "route"), (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+REQUEST_DB_SECONDS = Histogram(
+    "greenpark_request_db_seconds", "Time spent in Mongo commands per request",
+    ("method", "route"), (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+REQUEST_ROUNDTRIPS = Histogram(
+    "greenpark_request_mongo_roundtrips", "Mongo commands issued per request",
+    ("method", "route"), (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+)
+MONGO_COMMANDS = Counter(
+    "greenpark_mongo_commands_total", "Mongo commands by route, collection and command",
+    ("route", "collection", "command")
+)
+MONGO_DOCS = Counter(
+    "greenpark_mongo_docs_returned_total", "Documents returned by Mongo per route",
+    ("route",)
+)
+
+mongo_monitor = MongoCommandMonitor()
+ROUNDTRIP_BUDGET = int(os.environ.get('MONGO_ROUNDTRIP_BUDGET', '10'))
+
+# MongoDB connection, opened per worker by the lifespan below
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+def connect_db():
+    """Open this worker's Motor client; pools are per process, so size them per worker"""
+    global client, db
+    client = AsyncIOMotorClient(
+        mongo_url,
+        maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+        event_listeners=[mongo_monitor]
+    )
+    db = client[os.environ['DB_NAME']]
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sockets, pools and tasks are created here, after the server has
+    # forked its workers, never at import time
+    connect_db()
+    await on_startup()
+    try:
+        yield
+    finally:
+        await on_shutdown()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 # ============ MODELS ============
@@ -59,6 +220,7 @@ class Booking(BaseModel):
     end_time: datetime
     duration_hours: float
     amount: float
+    rate_per_hour: Optional[float] = None  # quoted rate, locked in at booking time
     status: str  # pending, active, completed, cancelled
     ev_charging: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -81,8 +243,10 @@ class Reward(BaseModel):
     points: int = 0
     level: str = "Eco Starter"
     carbon_saved: float = 0.0
+    balance: float = 0.0
     badges: List[str] = []
     monthly_carbon: List[dict] = []
+    recent_transaction_ids: List[str] = []
 
 class SharedSpace(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -95,25 +259,351 @@ class SharedSpace(BaseModel):
     slot_type: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# ============ SERIALIZATION ============
+
+def to_document(model: BaseModel, keep_dates: tuple = ()) -> dict:
+    """model_dump() with datetimes as ISO strings, the way documents are stored"""
+    doc = model.model_dump()
+    for key, value in doc.items():
+        if isinstance(value, datetime) and key not in keep_dates:
+            doc[key] = value.isoformat()
+    return doc
+
+def dump_json(obj) -> bytes:
+    """Shared encoder for Mongo documents and API payloads"""
+    return orjson.dumps(obj, default=str)
+
+# ============ SHARED STATE ============
+
+# Every worker process has its own caches, spot stream subscribers and
+# background tasks. For more than one worker, e.g.
+#   STATE_BACKEND=sqlite uvicorn server:app --workers 4
+# invalidations and spot deltas are relayed through a shared backend, and
+# once-per-deployment jobs only run in the worker holding their lease.
+
+def take_from_bucket(state: Optional[tuple], now: float, rate: float, burst: float) -> tuple:
+    """Token bucket step: (tokens left, seconds to wait; 0 if a token was taken)"""
+    tokens, updated = state if state else (burst, now)
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+class MemoryStateBackend:
+    """Single-worker backend: there is nobody to share with"""
+
+    def __init__(self):
+        # Least recently touched first, so eviction stops at the first live bucket
+        self._buckets = OrderedDict()
+
+    async def start(self, deliver):
+        pass
+
+    def publish(self, channel: str, message: dict):
+        pass
+
+    async def take_token(self, key: str, rate: float, burst: float) -> float:
+        now = time.time()
+        tokens, wait = take_from_bucket(self._buckets.get(key), now, rate, burst)
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        return wait
+
+    async def evict_buckets(self, idle: float) -> int:
+        cutoff = time.time() - idle
+        evicted = 0
+        while self._buckets and next(iter(self._buckets.values()))[1] < cutoff:
+            self._buckets.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    async def hold_lease(self, name: str, ttl: float) -> bool:
+        return True
+
+    async def release_lease(self, name: str):
+        pass
+
+    async def close(self):
+        pass
+
+class SQLiteStateBackend:
+    """State shared by the workers on one box through a SQLite file.
+
+    A local stand-in for a networked store such as Redis. Messages are
+    appended to a table that every worker polls; token buckets and leases
+    are rows updated inside IMMEDIATE transactions, so they are atomic
+    across processes.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.05, retention: float = 60.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.worker_id = uuid.uuid4().hex
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._outbox = []
+        self._last_id = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, channel TEXT, payload BLOB, created REAL
+            );
+            CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL);
+            CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated);
+            CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL);
+        """)
+        self._conn = conn
+        self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    def _transaction(self, fn):
+        # One connection per worker, used from executor threads one at a time
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn, time.time())
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    async def start(self, deliver):
+        await asyncio.to_thread(self._open)
+        self._task = asyncio.create_task(self._run(deliver))
+
+    def publish(self, channel: str, message: dict):
+        self._outbox.append((channel, orjson.dumps(message)))
+
+    def _exchange(self, outbox: List[tuple]) -> List[tuple]:
+        """Write this worker's pending messages, then read everything newer than the last seen"""
+        if outbox:
+            def write(conn, now):
+                conn.executemany(
+                    "INSERT INTO messages (origin, channel, payload, created) VALUES (?, ?, ?, ?)",
+                    [(self.worker_id, channel, payload, now) for channel, payload in outbox]
+                )
+                conn.execute("DELETE FROM messages WHERE created < ?", (now - self.retention,))
+            self._transaction(write)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, origin, channel, payload FROM messages WHERE id > ? ORDER BY id", (self._last_id,)
+            ).fetchall()
+
+    async def _run(self, deliver):
+        while True:
+            outbox, self._outbox = self._outbox, []
+            try:
+                rows = await asyncio.to_thread(self._exchange, outbox)
+            except Exception as e:
+                logger.error(f"Shared state exchange failed: {e}")
+                self._outbox[:0] = outbox
+                rows = []
+            for message_id, origin, channel, payload in rows:
+                self._last_id = message_id
+                if origin != self.worker_id:
+                    deliver(channel, orjson.loads(payload))
+            await asyncio.sleep(self.poll_interval)
+
+    async def take_token(self, key: str, rate: float, burst: float) -> float:
+        def take(conn, now):
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, wait = take_from_bucket(row, now, rate, burst)
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+            return wait
+        return await asyncio.to_thread(self._transaction, take)
+
+    async def evict_buckets(self, idle: float) -> int:
+        def evict(conn, now):
+            return conn.execute("DELETE FROM buckets WHERE updated < ?", (now - idle,)).rowcount
+        return await asyncio.to_thread(self._transaction, evict)
+
+    async def hold_lease(self, name: str, ttl: float) -> bool:
+        """Take or renew a named lease; only one worker holds it at a time"""
+        def hold(conn, now):
+            row = conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != self.worker_id and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires",
+                (name, self.worker_id, now + ttl)
+            )
+            return True
+        return await asyncio.to_thread(self._transaction, hold)
+
+    async def release_lease(self, name: str):
+        def release(conn, now):
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.worker_id))
+        await asyncio.to_thread(self._transaction, release)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._conn:
+            outbox, self._outbox = self._outbox, []
+            await asyncio.to_thread(self._exchange, outbox)
+            self._conn.close()
+            self._conn = None
+
+class SharedState:
+    """Routes cross-worker messages between local caches and the backend.
+
+    emit() applies a message in this worker straight away, so the writer
+    reads its own writes, then hands it to the backend for the other
+    workers, whose handlers apply it on arrival.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._handlers = {}
+
+    def subscribe(self, channel: str, handler):
+        self._handlers[channel] = handler
+
+    def emit(self, channel: str, message: dict):
+        self._handlers[channel](message)
+        self.backend.publish(channel, message)
+
+    def deliver(self, channel: str, message: dict):
+        handler = self._handlers.get(channel)
+        if handler is None:
+            return
+        try:
+            handler(message)
+        except Exception as e:
+            logger.error(f"Applying {channel} message failed: {e}")
+
+    async def leads(self, job: str, ttl: float) -> bool:
+        """Whether this worker should run a once-per-deployment job right now"""
+        return await self.backend.hold_lease(job, ttl)
+
+    async def start(self):
+        await self.backend.start(self.deliver)
+
+    async def close(self):
+        await self.backend.close()
+
+def make_state_backend():
+    kind = os.environ.get('STATE_BACKEND', 'memory')
+    if kind == 'sqlite':
+        return SQLiteStateBackend(
+            os.environ.get('STATE_SQLITE_PATH', '/tmp/greenpark-state.db'),
+            poll_interval=float(os.environ.get('STATE_POLL_INTERVAL', '0.05'))
+        )
+    if kind != 'memory':
+        raise RuntimeError(f"Unknown STATE_BACKEND {kind!r}, expected memory or sqlite")
+    return MemoryStateBackend()
+
+shared_state = SharedState(make_state_backend())
+
+# ============ SESSION CACHE ============
+
+class SessionCache:
+    """Bounded LRU/TTL cache of session token -> resolved User"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[User]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires = entry
+        if expires < time.monotonic():
+            del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: User, session_expires_at: datetime):
+        # Never keep an entry past the session's own expiry
+        remaining = (session_expires_at - datetime.now(timezone.utc)).total_seconds()
+        expires = time.monotonic() + min(self.ttl, remaining)
+        self._entries[token] = (user, expires)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, token: str):
+        shared_state.emit("sessions", {"token": token})
+
+    def invalidate_user(self, user_id: str):
+        shared_state.emit("sessions", {"user_id": user_id})
+
+    def apply(self, message: dict):
+        if 'token' in message:
+            self._entries.pop(message['token'], None)
+        else:
+            for token in [t for t, (u, _) in self._entries.items() if u.id == message['user_id']]:
+                del self._entries[token]
+
+    def render(self) -> List[str]:
+        """Prometheus lines for /metrics"""
+        return [
+            "# HELP greenpark_session_cache_lookups_total Session cache lookups by result",
+            "# TYPE greenpark_session_cache_lookups_total counter",
+            f'greenpark_session_cache_lookups_total{{result="hit"}} {self.hits}',
+            f'greenpark_session_cache_lookups_total{{result="miss"}} {self.misses}',
+            "# HELP greenpark_session_cache_entries Sessions held in the cache",
+            "# TYPE greenpark_session_cache_entries gauge",
+            f"greenpark_session_cache_entries {len(self._entries)}",
+        ]
+
+session_cache = SessionCache(
+    maxsize=int(os.environ.get('SESSION_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('SESSION_CACHE_TTL', '60'))
+)
+shared_state.subscribe("sessions", session_cache.apply)
+
 # ============ AUTH HELPER ============
 
+def _extract_token(request: Request, session_token: Optional[str]) -> Optional[str]:
+    """Session token from cookie first, then Authorization header"""
+    if session_token:
+        return session_token
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+    return None
+
 async def get_current_user(request: Request, session_token: Optional[str] = Cookie(None)) -> Optional[User]:
     """Check session from cookie first, then Authorization header"""
-    token = session_token
-    
-    if not token:
-        auth_header = request.headers.get('Authorization', '')
-        if auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
+    token = _extract_token(request, session_token)
     
     if not token:
         return None
     
+    cached = session_cache.get(token)
+    if cached:
+        return cached
+    
     session = await db.user_sessions.find_one({"session_token": token})
     if not session:
         return None
     
-    if datetime.fromisoformat(session['expires_at']) < datetime.now(timezone.utc):
+    expires_at = session['expires_at']
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at)
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at < datetime.now(timezone.utc):
         return None
     
     user_doc = await db.users.find_one({"id": session['user_id']}, {"_id": 0})
@@ -123,11 +613,209 @@ async def get_current_user(request: Request, session_token: Optional[str] = Cook
     if isinstance(user_doc.get('created_at'), str):
         user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    session_cache.put(token, user, expires_at)
+    return user
+
+# ============ RATE LIMITING ============
+
+# Requests per minute and burst size per limited route. Override or add
+# entries with RATE_LIMITS='{"history": [120, 30]}'.
+RATE_LIMITS = {
+    "login": (20, 10),
+    "bookings": (30, 10),
+    "payments": (30, 10),
+    "predictions": (60, 20),
+    "history": (60, 20),
+    "search": (120, 40),
+    "shared-spaces": (10, 5),
+    "simulate-iot": (12, 3),
+    "sensor-readings": (1200, 200),
+    "seed-data": (2, 1),
+}
+RATE_LIMITS.update({
+    name: tuple(limit) for name, limit in orjson.loads(os.environ.get('RATE_LIMITS', '{}')).items()
+})
+RATE_LIMIT_EVICT_INTERVAL = float(os.environ.get('RATE_LIMIT_EVICT_INTERVAL', '60'))
+# Reverse proxies in front of the app that append to X-Forwarded-For. With
+# 0 the socket peer is the client; behind an ingress set it to 1 so callers
+# aren't all keyed on the proxy address.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+
+RATE_LIMITED = Counter(
+    "greenpark_rate_limited_total", "Requests rejected with 429 by rate limit", ("limit",)
+)
+
+class RateLimiter:
+    """Token buckets per (limit, caller) kept in the shared state backend.
+
+    The caller is the route's own key when it has one (login is keyed on
+    the client address even for signed-in callers), else the session
+    user, else the client address. Each bucket is one (tokens,
+    updated) pair. A bucket idle long enough to refill completely behaves
+    exactly like a missing one, so those are evicted periodically and
+    memory follows the number of recently active callers.
+    """
+
+    def __init__(self, limits: dict, evict_interval: float = 60.0, proxy_hops: int = 0):
+        self.limits = limits
+        self.evict_interval = evict_interval
+        self.proxy_hops = proxy_hops
+        self._next_eviction = 0.0
+
+    @property
+    def idle_after(self) -> float:
+        # Seconds the slowest bucket needs to refill from empty
+        return max(60.0 * burst / per_minute for per_minute, burst in self.limits.values())
+
+    def client_address(self, request: Request) -> str:
+        if self.proxy_hops:
+            # Entries left of the trusted hops are whatever the client sent
+            forwarded = [a.strip() for a in request.headers.get('X-Forwarded-For', '').split(',') if a.strip()]
+            if len(forwarded) >= self.proxy_hops:
+                return forwarded[-self.proxy_hops]
+        return request.client.host if request.client else 'unknown'
+
+    async def caller(self, request: Request) -> str:
+        user = await get_current_user(request, request.cookies.get('session_token'))
+        if user:
+            return f"user:{user.id}"
+        return f"ip:{self.client_address(request)}"
+
+    async def check(self, request: Request, name: str, key: Optional[str] = None):
+        per_minute, burst = self.limits[name]
+        key = f"{name}:{key or await self.caller(request)}"
+        wait = await shared_state.backend.take_token(key, per_minute / 60.0, burst)
+
+        now = time.monotonic()
+        if now >= self._next_eviction:
+            self._next_eviction = now + self.evict_interval
+            await shared_state.backend.evict_buckets(self.idle_after)
+
+        if wait > 0:
+            RATE_LIMITED.inc((name,))
+            raise HTTPException(429, "Too many requests", headers={"Retry-After": str(math.ceil(wait))})
+
+rate_limiter = RateLimiter(RATE_LIMITS, RATE_LIMIT_EVICT_INTERVAL, TRUSTED_PROXY_HOPS)
+
+def rate_limited(name: str, key=None):
+    """Route dependency applying the named entry of RATE_LIMITS.
+
+    key optionally maps the request to its own caller key; requests it
+    returns None for fall back to the session user or client address.
+    """
+    async def check(request: Request):
+        await rate_limiter.check(request, name, key(request) if key else None)
+    return Depends(check)
+
+def client_key(request: Request) -> str:
+    # Session ids are chosen by the caller, so they can't key a limit on exchanges
+    return f"ip:{rate_limiter.client_address(request)}"
+
+# ============ AUTH UPSTREAM ============
+
+class AuthUpstream:
+    """App-lifetime pooled client for the Emergent auth session exchange"""
+
+    def __init__(self, url: str, max_concurrency: int = 20, timeout: float = 10.0):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=60
+                )
+            )
+        return self._client
+
+    async def fetch_session_data(self, session_id: str) -> dict:
+        async with self._semaphore:
+            resp = await self.client().get(self.url, headers={"X-Session-ID": session_id})
+        if resp.status_code != 200:
+            raise HTTPException(401, "Invalid session")
+        return resp.json()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key onto one in-flight task"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # One caller disconnecting must not cancel the exchange for the others
+        return await asyncio.shield(task)
+
+auth_upstream = AuthUpstream(
+    os.environ.get('EMERGENT_AUTH_URL', "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"),
+    max_concurrency=int(os.environ.get('AUTH_MAX_CONCURRENCY', '20')),
+    timeout=float(os.environ.get('AUTH_HTTP_TIMEOUT', '10'))
+)
+session_exchanges = SingleFlight()
+
+async def exchange_session(session_id: str) -> tuple:
+    """Resolve an X-Session-ID to (user, session_token), creating both as needed"""
+    data = await auth_upstream.fetch_session_data(session_id)
+    
+    # Upserts, so a repeated exchange or two first logins at once both succeed
+    new_user = User(
+        id=data['id'],
+        email=data['email'],
+        name=data['name'],
+        picture=data.get('picture')
+    )
+    user_doc = await db.users.find_one_and_update(
+        {"email": new_user.email},
+        {"$setOnInsert": to_document(new_user)},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    user = User(**user_doc)
+    
+    # Initialize rewards for new user
+    reward = Reward(user_id=user.id).model_dump()
+    del reward['user_id']
+    await db.rewards.update_one({"user_id": user.id}, {"$setOnInsert": reward}, upsert=True)
+    
+    # Create session
+    session_token = data['session_token']
+    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
+    session = UserSession(
+        user_id=user.id,
+        session_token=session_token,
+        expires_at=expires_at
+    )
+    # expires_at stays a BSON date so the TTL index can reap it
+    await db.user_sessions.update_one(
+        {"session_token": session_token},
+        {"$set": to_document(session, keep_dates=('expires_at',))},
+        upsert=True
+    )
+    
+    return user, session_token
 
 # ============ AUTH ENDPOINTS ============
 
-@api_router.post("/auth/session-data")
+@api_router.post("/auth/session-data", dependencies=[rate_limited("login", client_key)])
 async def process_session(request: Request, response: Response):
     """Process session_id from Emergent Auth"""
     session_id = request.headers.get('X-Session-ID')
@@ -135,63 +823,26 @@ async def process_session(request: Request, response: Response):
         raise HTTPException(400, "Missing session ID")
     
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_id}
-            )
-            if resp.status_code != 200:
-                raise HTTPException(401, "Invalid session")
-            
-            data = resp.json()
-            
-            # Check if user exists
-            existing_user = await db.users.find_one({"email": data['email']}, {"_id": 0})
-            
-            if not existing_user:
-                user = User(
-                    id=data['id'],
-                    email=data['email'],
-                    name=data['name'],
-                    picture=data.get('picture')
-                )
-                user_dict = user.model_dump()
-                user_dict['created_at'] = user_dict['created_at'].isoformat()
-                await db.users.insert_one(user_dict)
-                
-                # Initialize rewards for new user
-                reward = Reward(user_id=user.id)
-                await db.rewards.insert_one(reward.model_dump())
-            else:
-                user = User(**existing_user)
-            
-            # Create session
-            session_token = data['session_token']
-            expires_at = datetime.now(timezone.utc) + timedelta(days=7)
-            session = UserSession(
-                user_id=user.id,
-                session_token=session_token,
-                expires_at=expires_at
-            )
-            session_dict = session.model_dump()
-            session_dict['expires_at'] = session_dict['expires_at'].isoformat()
-            session_dict['created_at'] = session_dict['created_at'].isoformat()
-            await db.user_sessions.insert_one(session_dict)
-            
-            # Set httpOnly cookie
-            response.set_cookie(
-                key="session_token",
-                value=session_token,
-                httponly=True,
-                secure=True,
-                samesite="none",
-                max_age=7*24*60*60,
-                path="/"
-            )
-            
-            return {"user": user.model_dump(), "session_token": session_token}
+        user, session_token = await session_exchanges.do(session_id, lambda: exchange_session(session_id))
+    except HTTPException:
+        raise
+    except httpx.TimeoutException:
+        raise HTTPException(504, "Auth provider timed out")
     except Exception as e:
         raise HTTPException(500, f"Auth error: {str(e)}")
+    
+    # Set httpOnly cookie
+    response.set_cookie(
+        key="session_token",
+        value=session_token,
+        httponly=True,
+        secure=True,
+        samesite="none",
+        max_age=7*24*60*60,
+        path="/"
+    )
+    
+    return {"user": user.model_dump(), "session_token": session_token}
 
 @api_router.get("/auth/me")
 async def get_me(request: Request, session_token: Optional[str] = Cookie(None)):
@@ -202,30 +853,379 @@ async def get_me(request: Request, session_token: Optional[str] = Cookie(None)):
 
 @api_router.post("/auth/logout")
 async def logout(request: Request, response: Response, session_token: Optional[str] = Cookie(None)):
-    if session_token:
-        await db.user_sessions.delete_one({"session_token": session_token})
+    token = _extract_token(request, session_token)
+    if token:
+        # Delete first: invalidating before the delete lets a concurrent
+        # request re-cache the session in between
+        await db.user_sessions.delete_one({"session_token": token})
+        session_cache.invalidate(token)
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out"}
 
+# ============ RESPONSE CACHE ============
+
+class ResponseCache:
+    """Pre-serialized JSON bodies with ETags, grouped into namespaces.
+
+    Write paths invalidate a whole namespace or a single key. Each
+    namespace has a generation counter so a load that raced with an
+    invalidation is never stored. Loaders return (payload, headers), and
+    the headers are cached and replayed along with the body.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def respond(self, request: Request, namespace: str, key, loader) -> Response:
+        entry = self._entries.get(namespace, {}).get(key)
+        if entry is None:
+            self.misses += 1
+            generation = self._generations.get(namespace, 0)
+            payload, headers = await loader()
+            body = dump_json(payload)
+            entry = (body, {**headers, "ETag": f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"', "Vary": "Accept"})
+            if self._generations.get(namespace, 0) == generation:
+                self._entries.setdefault(namespace, {})[key] = entry
+        else:
+            self.hits += 1
+        body, headers = entry
+        if request.headers.get('If-None-Match') == headers['ETag']:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def invalidate(self, namespace: str, key=None):
+        shared_state.emit("responses", {"namespace": namespace, "key": key})
+
+    def apply(self, message: dict):
+        namespace, key = message['namespace'], message['key']
+        if isinstance(key, list):
+            # Tuple keys come back from other workers as JSON arrays
+            key = tuple(key)
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        if key is None:
+            self._entries.pop(namespace, None)
+        else:
+            self._entries.get(namespace, {}).pop(key, None)
+
+response_cache = ResponseCache()
+shared_state.subscribe("responses", response_cache.apply)
+
+# ============ NDJSON STREAMING ============
+
+NDJSON = "application/x-ndjson"
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '500'))
+# Cap on plain JSON list responses; NDJSON has none
+LIST_LIMIT = int(os.environ.get('LIST_LIMIT', '1000'))
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get('Accept', '')
+
+def ndjson_response(cursor, header: Optional[dict] = None, transform=None) -> StreamingResponse:
+    """Stream a Motor cursor one JSON document per line, with no result limit.
+
+    Documents are written as each batch arrives, so memory stays flat no
+    matter how many match. An optional header object goes out first, and
+    an optional transform is applied to each document.
+    """
+    async def lines():
+        if header is not None:
+            yield dump_json(header) + b"\n"
+        async for doc in cursor.batch_size(STREAM_BATCH_SIZE):
+            yield dump_json(transform(doc) if transform else doc) + b"\n"
+    
+    return StreamingResponse(lines(), media_type=NDJSON, headers={"Vary": "Accept"})
+
+async def bounded_list(cursor, limit: int = LIST_LIMIT) -> tuple:
+    """(up to limit documents, headers): X-Truncated is set when more matched.
+
+    One extra document is read to tell a full list from a cut one, so
+    callers can point clients at the NDJSON form instead of silently
+    dropping rows.
+    """
+    rows = await cursor.to_list(limit + 1)
+    if len(rows) > limit:
+        return rows[:limit], {"X-Truncated": "true"}
+    return rows, {}
+
+def invalidate_spots(spot_ids: Optional[List[str]] = None):
+    response_cache.invalidate("spots")
+    if spot_ids is None:
+        response_cache.invalidate("spot")
+    else:
+        for spot_id in spot_ids:
+            response_cache.invalidate("spot", spot_id)
+
 # ============ PARKING SPOTS ============
 
 @api_router.get("/spots")
-async def get_spots(status: Optional[str] = None, ev_charging: Optional[bool] = None):
+async def get_spots(request: Request, status: Optional[str] = None, ev_charging: Optional[bool] = None):
+    # status is part of the cache key, so only known values may reach it
+    if status and status not in SPOT_STATUSES:
+        raise HTTPException(422, f"status must be one of {', '.join(SPOT_STATUSES)}")
     query = {}
     if status:
         query['status'] = status
     if ev_charging is not None:
         query['ev_charging'] = ev_charging
     
-    spots = await db.spots.find(query, {"_id": 0}).to_list(1000)
-    return spots
+    if wants_ndjson(request):
+        return ndjson_response(db.spots.find(query, {"_id": 0}), transform=pricing.decorate)
+    
+    async def load():
+        spots, headers = await bounded_list(db.spots.find(query, {"_id": 0}))
+        return [pricing.decorate(spot) for spot in spots], headers
+    
+    return await response_cache.respond(request, "spots", (status, ev_charging), load)
+
+class SpotUpdateHub:
+    """Fan-out of spot status deltas to stream subscribers in every worker.
+
+    Each subscriber owns a bounded queue. A subscriber that falls behind is
+    not allowed to hold up publishers: its backlog is dropped and replaced
+    with a resync marker, so it gets a fresh snapshot instead.
+    """
+
+    RESYNC = None
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _offer(self, queue: asyncio.Queue, item):
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(self.RESYNC)
+
+    def publish(self, deltas: List[dict]):
+        if deltas:
+            shared_state.emit("spot_updates", {"deltas": deltas})
+
+    def resync(self):
+        shared_state.emit("spot_updates", {"deltas": None})
+
+    def apply(self, message: dict):
+        item = message['deltas'] or self.RESYNC
+        for queue in list(self._subscribers):
+            self._offer(queue, item)
+
+    def push_rates(self, rates: dict):
+        """{spot id: current_rate} to this worker's subscribers only.
+
+        Every worker reprices from the same lot_stats on its own, so rate
+        changes aren't relayed through the shared state.
+        """
+        if rates:
+            for queue in list(self._subscribers):
+                self._offer(queue, {"rates": rates})
+
+spot_hub = SpotUpdateHub(queue_size=int(os.environ.get('SPOT_STREAM_QUEUE_SIZE', '256')))
+shared_state.subscribe("spot_updates", spot_hub.apply)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {dump_json(data).decode()}\n\n"
+
+async def snapshot_events():
+    """The spot snapshot in pages: "snapshot" replaces the client's list,
+    each following "snapshot_page" appends to it.
+    """
+    page, event = [], "snapshot"
+    async for spot in db.spots.find({}, {"_id": 0}).batch_size(STREAM_BATCH_SIZE):
+        page.append(pricing.decorate(spot))
+        if len(page) >= STREAM_BATCH_SIZE:
+            yield _sse(event, page)
+            page, event = [], "snapshot_page"
+    if page or event == "snapshot":
+        yield _sse(event, page)
+
+@api_router.get("/spots/stream")
+async def stream_spots(request: Request):
+    """Server-sent events: one spot snapshot, then {id, status} deltas and {id: rate} changes"""
+    queue = spot_hub.subscribe()
+    
+    async def events():
+        try:
+            # Subscribed before the snapshot read, so no delta can slip between them
+            async for event in snapshot_events():
+                yield event
+            while not await request.is_disconnected():
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is SpotUpdateHub.RESYNC:
+                    async for event in snapshot_events():
+                        yield event
+                elif isinstance(item, dict):
+                    yield _sse("rates", item['rates'])
+                else:
+                    yield _sse("delta", item)
+        finally:
+            spot_hub.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def geo_point(location: dict) -> Optional[dict]:
+    """GeoJSON point for a {"lat", "lng"} location, as the 2dsphere index expects"""
+    lat, lng = location.get('lat'), location.get('lng')
+    if isinstance(lat, (int, float)) and isinstance(lng, (int, float)):
+        return {"type": "Point", "coordinates": [lng, lat]}
+    return None
+
+NEARBY_OVERFETCH = 4
+NEARBY_MAX_FETCH = 1000
+
+@api_router.get("/spots/nearby", dependencies=[rate_limited("search")])
+async def get_nearby_spots(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: float = Query(1000, gt=0, le=50000),
+    limit: int = Query(10, ge=1, le=100),
+    ev_charging: Optional[bool] = None,
+    max_rate: Optional[float] = None
+):
+    """k nearest available spots and shared spaces within radius metres"""
+    spot_query = {"status": "available"}
+    space_query = {"available": True}
+    if ev_charging is not None:
+        spot_query['ev_charging'] = ev_charging
+        space_query['slot_type'] = "ev_charging" if ev_charging else {"$ne": "ev_charging"}
+    if max_rate is not None:
+        # Spots are charged the surge quote, which is only known after the
+        # query; narrow by the lowest possible quote and filter exactly below
+        spot_query['rate_per_hour'] = {"$lte": max_rate / SURGE_MIN}
+        space_query['rate_per_hour'] = {"$lte": max_rate}
+    
+    def pipeline(query: dict, kind: str, limit: int) -> List[dict]:
+        return [
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [lng, lat]},
+                "key": "geo",
+                "distanceField": "distance_m",
+                "maxDistance": radius,
+                "query": query,
+                "spherical": True
+            }},
+            {"$limit": limit},
+            {"$project": {"_id": 0, "geo": 0}},
+            {"$addFields": {"kind": kind}}
+        ]
+    
+    async def nearest_spots() -> List[dict]:
+        # Over-fetch when filtering on the quote, widening only while the
+        # filter leaves fewer than limit and the radius may hold more
+        fetch = limit if max_rate is None else limit * NEARBY_OVERFETCH
+        while True:
+            rows = await db.spots.aggregate(pipeline(spot_query, "spot", fetch)).to_list(fetch)
+            spots = [pricing.decorate(spot) for spot in rows]
+            if max_rate is not None:
+                spots = [spot for spot in spots if spot['current_rate'] <= max_rate]
+            if len(spots) >= limit or len(rows) < fetch or fetch >= NEARBY_MAX_FETCH:
+                return spots[:limit]
+            fetch = min(fetch * NEARBY_OVERFETCH, NEARBY_MAX_FETCH)
+    
+    spots, spaces = await asyncio.gather(
+        nearest_spots(),
+        db.shared_spaces.aggregate(pipeline(space_query, "shared_space", limit)).to_list(limit)
+    )
+    # Both lists arrive sorted by distance; keep the overall k nearest
+    return ORJSONResponse(sorted(spots + spaces, key=lambda r: r['distance_m'])[:limit])
 
 @api_router.get("/spots/{spot_id}")
-async def get_spot(spot_id: str):
-    spot = await db.spots.find_one({"id": spot_id}, {"_id": 0})
-    if not spot:
-        raise HTTPException(404, "Spot not found")
-    return spot
+async def get_spot(spot_id: str, request: Request):
+    async def load():
+        spot = await db.spots.find_one({"id": spot_id}, {"_id": 0})
+        if not spot:
+            raise HTTPException(404, "Spot not found")
+        return pricing.decorate(spot), {}
+    
+    return await response_cache.respond(request, "spot", spot_id, load)
+
+# ============ LOTS ============
+
+SPOT_STATUSES = ('available', 'occupied', 'reserved', 'soon_available')
+
+def lot_transition(spot: dict, new_status: str) -> dict:
+    """$inc for a lot_stats document when one spot changes status"""
+    old_status = spot['status']
+    inc = {old_status: -1, new_status: 1}
+    if spot.get('ev_charging') and (old_status == 'available') != (new_status == 'available'):
+        inc['ev_available'] = 1 if new_status == 'available' else -1
+    return inc
+
+async def apply_lot_transitions(transitions: List[tuple]):
+    """Fold (spot, new_status) pairs into the per-lot counters in one bulk_write"""
+    by_lot = {}
+    for spot, new_status in transitions:
+        inc = by_lot.setdefault(spot['lot_id'], {})
+        for key, delta in lot_transition(spot, new_status).items():
+            inc[key] = inc.get(key, 0) + delta
+    writes = [
+        UpdateOne({"lot_id": lot_id}, {"$inc": {k: v for k, v in inc.items() if v}}, upsert=True)
+        for lot_id, inc in by_lot.items()
+        if any(inc.values())
+    ]
+    if writes:
+        await db.lot_stats.bulk_write(writes, ordered=False)
+
+async def settle_lot_transitions(transitions: List[tuple], modified_count: int):
+    """Apply counters for a conditional bulk update of spot statuses.
+
+    If some updates lost a race and didn't apply, we can't tell which, so
+    the affected lots are recounted instead.
+    """
+    if modified_count == len(transitions):
+        await apply_lot_transitions(transitions)
+    else:
+        for lot_id in {spot['lot_id'] for spot, _ in transitions}:
+            await rebuild_lot_stats(lot_id)
+
+async def rebuild_lot_stats(lot_id: Optional[str] = None):
+    """Recount lot_stats from spots; walks the (lot_id, status) index, one lot or all"""
+    pipeline = [{"$match": {"lot_id": lot_id}}] if lot_id else []
+    group = {"_id": "$lot_id", "total": {"$sum": 1}}
+    for status in SPOT_STATUSES:
+        group[status] = {"$sum": {"$cond": [{"$eq": ["$status", status]}, 1, 0]}}
+    group['ev_total'] = {"$sum": {"$cond": ["$ev_charging", 1, 0]}}
+    group['ev_available'] = {"$sum": {"$cond": [
+        {"$and": ["$ev_charging", {"$eq": ["$status", "available"]}]}, 1, 0
+    ]}}
+    pipeline.append({"$group": group})
+    lots = [{"lot_id": row.pop('_id'), **row} for row in await db.spots.aggregate(pipeline).to_list(None)]
+    if lots:
+        await db.lot_stats.bulk_write([ReplaceOne({"lot_id": lot['lot_id']}, lot, upsert=True) for lot in lots], ordered=False)
+    if lot_id is None:
+        await db.lot_stats.delete_many({"lot_id": {"$nin": [lot['lot_id'] for lot in lots]}})
+
+@api_router.get("/lots")
+async def get_lots():
+    lots = await db.lot_stats.find({}, {"_id": 0}).sort("lot_id", 1).to_list(None)
+    return ORJSONResponse(lots)
+
+@api_router.get("/lots/{lot_id}")
+async def get_lot(lot_id: str):
+    lot = await db.lot_stats.find_one({"lot_id": lot_id}, {"_id": 0})
+    if not lot:
+        raise HTTPException(404, "Lot not found")
+    return ORJSONResponse(lot)
 
 # ============ BOOKINGS ============
 
@@ -234,47 +1234,79 @@ class BookingCreate(BaseModel):
     duration_hours: float
     ev_charging: bool = False
 
-@api_router.post("/bookings")
+@api_router.post("/bookings", dependencies=[rate_limited("bookings")])
 async def create_booking(booking_data: BookingCreate, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_current_user(request, session_token)
     if not user:
         raise HTTPException(401, "Not authenticated")
     
-    spot = await db.spots.find_one({"id": booking_data.spot_id}, {"_id": 0})
+    # Claim the spot atomically: only one concurrent request can flip it.
+    # reserved_by records the holder, so releases only undo their own claim.
+    booking_id = str(uuid.uuid4())
+    spot = await db.spots.find_one_and_update(
+        {"id": booking_data.spot_id, "status": "available"},
+        {"$set": {"status": "reserved", "reserved_by": booking_id}},
+        projection={"_id": 0}
+    )
     if not spot:
-        raise HTTPException(404, "Spot not found")
-    
-    if spot['status'] != 'available':
+        if not await db.spots.find_one({"id": booking_data.spot_id}, {"_id": 1}):
+            raise HTTPException(404, "Spot not found")
         raise HTTPException(400, "Spot not available")
+    invalidate_spots([booking_data.spot_id])
+    await apply_lot_transitions([(spot, "reserved")])
     
     start_time = datetime.now(timezone.utc)
     end_time = start_time + timedelta(hours=booking_data.duration_hours)
     
-    base_amount = spot['rate_per_hour'] * booking_data.duration_hours
-    ev_charge = 50 if booking_data.ev_charging else 0
+    rate, _ = pricing.quote(spot)
+    base_amount = rate * booking_data.duration_hours
+    ev_charge = EV_CHARGE_FEE if booking_data.ev_charging else 0
     total_amount = base_amount + ev_charge
     
     booking = Booking(
+        id=booking_id,
         user_id=user.id,
         spot_id=booking_data.spot_id,
         start_time=start_time,
         end_time=end_time,
         duration_hours=booking_data.duration_hours,
         amount=total_amount,
+        rate_per_hour=rate,
         status="pending",
         ev_charging=booking_data.ev_charging
     )
     
-    booking_dict = booking.model_dump()
-    booking_dict['start_time'] = booking_dict['start_time'].isoformat()
-    booking_dict['end_time'] = booking_dict['end_time'].isoformat()
-    booking_dict['created_at'] = booking_dict['created_at'].isoformat()
-    await db.bookings.insert_one(booking_dict)
+    booking_dict = to_document(booking)
+    try:
+        await _insert_booking(booking_dict)
+    except Exception:
+        # Give the claim back so the spot doesn't stay reserved with no booking
+        released = await db.spots.update_one(
+            {"id": booking_data.spot_id, "status": "reserved", "reserved_by": booking_id},
+            {"$set": {"status": "available"}, "$unset": {"reserved_by": ""}}
+        )
+        if released.modified_count:
+            await apply_lot_transitions([({**spot, "status": "reserved"}, "available")])
+        invalidate_spots([booking_data.spot_id])
+        raise HTTPException(500, "Booking failed, please retry")
     
-    # Update spot status
-    await db.spots.update_one({"id": booking_data.spot_id}, {"$set": {"status": "reserved"}})
+    spot_hub.publish([{"id": booking_data.spot_id, "status": "reserved"}])
     
-    return booking.model_dump()
+    return ORJSONResponse(booking_dict)
+
+async def _insert_booking(booking_dict: dict, attempts: int = 3):
+    for attempt in range(attempts):
+        try:
+            # insert_one adds _id to the dict it is given
+            await db.bookings.insert_one(dict(booking_dict))
+            return
+        except DuplicateKeyError:
+            # An earlier attempt landed before the connection dropped
+            return
+        except AutoReconnect:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(0.05 * 2 ** attempt)
 
 @api_router.get("/bookings")
 async def get_bookings(request: Request, session_token: Optional[str] = Cookie(None)):
@@ -282,50 +1314,299 @@ async def get_bookings(request: Request, session_token: Optional[str] = Cookie(N
     if not user:
         raise HTTPException(401, "Not authenticated")
     
-    bookings = await db.bookings.find({"user_id": user.id}, {"_id": 0}).to_list(1000)
-    return bookings
+    cursor = db.bookings.find({"user_id": user.id}, {"_id": 0})
+    if wants_ndjson(request):
+        return ndjson_response(cursor)
+    
+    bookings, headers = await bounded_list(cursor)
+    return ORJSONResponse(bookings, headers=headers)
 
 # ============ PREDICTIONS ============
 
+SLOT_MINUTES = 10
+WEEK_SLOTS = 7 * 24 * 60 // SLOT_MINUTES
+
+def week_slot(ts: datetime) -> int:
+    return (ts.weekday() * 24 * 60 + ts.hour * 60 + ts.minute) // SLOT_MINUTES
+
+def _train_occupancy(lot_ids: List[str], hours: List[datetime], occupied: List[int], readings: List[int]) -> dict:
+    """Count occupied/total observations per lot and time-of-week slot.
+
+    Input is hourly rollups; each hour's counts go to all of its slots.
+    Runs in a worker process; returns {lot_id: int64 array of shape (2, WEEK_SLOTS)}.
+    """
+    df = pd.DataFrame({
+        "lot": lot_ids,
+        "ts": pd.to_datetime(hours, utc=True),
+        "occupied": occupied,
+        "readings": readings
+    })
+    df['slot'] = (df['ts'].dt.dayofweek * 24 + df['ts'].dt.hour) * (60 // SLOT_MINUTES)
+    counts = {}
+    for lot, group in df.groupby('lot'):
+        first = group['slot'].to_numpy()
+        slots = (first[:, None] + np.arange(60 // SLOT_MINUTES)).ravel()
+        counts[lot] = np.stack([
+            np.bincount(slots, weights=np.repeat(group['occupied'].to_numpy(), 60 // SLOT_MINUTES), minlength=WEEK_SLOTS),
+            np.bincount(slots, weights=np.repeat(group['readings'].to_numpy(), 60 // SLOT_MINUTES), minlength=WEEK_SLOTS)
+        ]).astype(np.int64)
+    return counts
+
+class OccupancyForecaster:
+    """Per-lot, per-time-of-week availability table built from hourly rollups.
+
+    Training folds newly completed hours into running counts in a worker
+    process; a prediction is a slice of the precomputed table.
+    """
+
+    ALL_LOTS = "*"
+    PRIOR_WEIGHT = 5.0
+
+    def __init__(self):
+        self._counts = {}
+        self._availability = {}
+        self._confidence = {}
+        self._last_hour: Optional[datetime] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def trained(self) -> bool:
+        return bool(self._availability)
+
+    def lookup(self, lot_id: str, slot: int, steps: int) -> Optional[tuple]:
+        """(availability percentages, confidence) for steps slots; None until trained"""
+        lot = lot_id if lot_id in self._availability else self.ALL_LOTS
+        table = self._availability.get(lot)
+        if table is None:
+            return None
+        indices = (slot + np.arange(steps)) % WEEK_SLOTS
+        return table[indices], int(self._confidence[lot][indices].mean())
+
+    async def retrain(self):
+        query = {"complete": True}
+        if self._last_hour:
+            query['hour'] = {"$gt": self._last_hour}
+        rows = await db.lot_occupancy_hourly.find(
+            query, {"_id": 0, "lot_id": 1, "hour": 1, "occupied": 1, "readings": 1}
+        ).sort("hour", 1).to_list(None)
+        if not rows:
+            return
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=1)
+        new_counts = await asyncio.get_running_loop().run_in_executor(
+            self._pool, _train_occupancy,
+            [r['lot_id'] for r in rows], [as_utc(r['hour']) for r in rows],
+            [r['occupied'] for r in rows], [r['readings'] for r in rows]
+        )
+        for lot, counts in new_counts.items():
+            self._counts[lot] = self._counts.get(lot, 0) + counts
+        self._rebuild()
+        self._last_hour = as_utc(rows[-1]['hour'])
+
+    def _rebuild(self):
+        counts = dict(self._counts)
+        counts[self.ALL_LOTS] = sum(self._counts.values())
+        availability, confidence = {}, {}
+        for lot, (occupied, total) in counts.items():
+            # Shrink sparse slots towards the lot's weekly mean
+            prior = occupied.sum() / max(total.sum(), 1)
+            rate = (occupied + self.PRIOR_WEIGHT * prior) / (total + self.PRIOR_WEIGHT)
+            availability[lot] = np.round(100 * (1 - rate)).astype(np.int64)
+            confidence[lot] = np.round(50 + 45 * (1 - np.exp(-total / 20))).astype(np.int64)
+        self._availability, self._confidence = availability, confidence
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                await self.retrain()
+            except Exception as e:
+                logger.error(f"Forecaster retrain failed: {e}")
+            await asyncio.sleep(interval)
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+forecaster = OccupancyForecaster()
+
 class PredictionRequest(BaseModel):
     destination: str
     arrival_time: str
     duration: float
 
-@api_router.post("/predict-availability")
+@api_router.post("/predict-availability", dependencies=[rate_limited("predictions")])
 async def predict_availability(pred: PredictionRequest):
-    # Mock AI prediction
+    try:
+        arrival = datetime.fromisoformat(pred.arrival_time)
+    except ValueError:
+        arrival = None
+    # Training slots are UTC; a local wall-clock time would be off by the user's offset
+    if arrival is None or arrival.tzinfo is None:
+        raise HTTPException(422, "arrival_time must be an ISO 8601 time with a UTC offset, e.g. 2024-05-01T09:00:00+05:30")
+    
+    steps = 6
+    forecast = forecaster.lookup(pred.destination, week_slot(arrival.astimezone(timezone.utc)), steps)
+    if forecast is None:
+        return {
+            "destination": pred.destination,
+            "trained": False,
+            "message": "Not enough occupancy history to forecast yet",
+            "predictions": [],
+            "confidence": 0,
+            "recommended_slot": None
+        }
+    availabilities, confidence = forecast
     predictions = []
-    for i in range(6):
-        time_slot = f"+{i*10} min"
-        availability = random.randint(40, 95)
+    for i, availability in enumerate(availabilities.tolist()):
         predictions.append({
-            "time": time_slot,
+            "time": f"+{i*SLOT_MINUTES} min",
             "availability": availability,
             "status": "high" if availability > 70 else "medium" if availability > 50 else "low"
         })
     
     return {
         "destination": pred.destination,
+        "trained": True,
         "predictions": predictions,
-        "confidence": random.randint(75, 95),
-        "recommended_slot": predictions[0]
+        "confidence": confidence,
+        "recommended_slot": max(predictions, key=lambda p: p['availability'])
     }
 
+# ============ PRICING ============
+
+SURGE_MIN = float(os.environ.get('SURGE_MIN', '0.8'))
+SURGE_MAX = float(os.environ.get('SURGE_MAX', '2.0'))
+SURGE_THRESHOLD = 0.6
+FORECAST_WEIGHT = 0.5
+EV_CHARGE_FEE = 50
+
+def surge_multipliers(demand: np.ndarray) -> np.ndarray:
+    """Price multiplier per lot for demand in [0, 1].
+
+    Rises linearly from SURGE_MIN for an empty lot to 1.0 at SURGE_THRESHOLD,
+    then on to SURGE_MAX for a full one.
+    """
+    demand = np.clip(demand, 0.0, 1.0)
+    below = SURGE_MIN + (1 - SURGE_MIN) * demand / SURGE_THRESHOLD
+    above = 1 + (SURGE_MAX - 1) * (demand - SURGE_THRESHOLD) / (1 - SURGE_THRESHOLD)
+    return np.round(np.where(demand < SURGE_THRESHOLD, below, above), 2)
+
+class PricingEngine:
+    """Demand-based hourly rates for every spot, held in memory.
+
+    The spot catalog (id, lot, base rate) is kept as arrays. A repricing
+    pass computes one multiplier per lot from lot_stats occupancy and the
+    forecast for the next hour, then broadcasts it over all spots at once.
+    Quotes are read from the resulting table without touching the DB.
+    """
+
+    HORIZON_SLOTS = 60 // SLOT_MINUTES
+
+    def __init__(self):
+        self._index = {}
+        self._ids: List[str] = []
+        self._lot_ids: List[str] = []
+        self._lot_of = np.zeros(0, dtype=np.int64)
+        self._base = np.zeros(0)
+        self._rates = np.zeros(0)
+        self._multipliers = np.zeros(0)
+        self._catalog_stale = True
+
+    def load_catalog(self, spots: List[dict]):
+        lot_index = {}
+        lot_of = np.fromiter(
+            (lot_index.setdefault(spot.get('lot_id'), len(lot_index)) for spot in spots),
+            dtype=np.int64, count=len(spots)
+        )
+        base = np.fromiter((spot['rate_per_hour'] for spot in spots), dtype=np.float64, count=len(spots))
+        # Swap everything in at once so quotes never see a half-built table
+        self._index = {spot['id']: row for row, spot in enumerate(spots)}
+        self._ids = [spot['id'] for spot in spots]
+        self._lot_of, self._base, self._rates = lot_of, base, base.copy()
+        self._lot_ids = list(lot_index)
+        self._multipliers = np.ones(len(self._lot_ids))
+        self._catalog_stale = False
+
+    def invalidate_catalog(self):
+        self._catalog_stale = True
+
+    def reprice(self, lots: List[dict], now: Optional[datetime] = None) -> bool:
+        """One pass over the whole catalog; returns whether any rate changed"""
+        stats = {lot['lot_id']: lot for lot in lots}
+        occupancy = np.zeros(len(self._lot_ids))
+        for i, lot_id in enumerate(self._lot_ids):
+            lot = stats.get(lot_id)
+            if lot and lot.get('total'):
+                occupancy[i] = 1 - lot.get('available', 0) / lot['total']
+        demand = occupancy
+        if forecaster.trained:
+            slot = week_slot(now or datetime.now(timezone.utc))
+            predicted = np.array([
+                1 - forecaster.lookup(lot_id, slot, self.HORIZON_SLOTS)[0].mean() / 100
+                for lot_id in self._lot_ids
+            ])
+            demand = (1 - FORECAST_WEIGHT) * occupancy + FORECAST_WEIGHT * predicted
+        multipliers = surge_multipliers(demand)
+        rates = np.round(self._base * multipliers[self._lot_of])
+        changed = not np.array_equal(rates, self._rates)
+        self._multipliers, self._rates = multipliers, rates
+        return changed
+
+    def quote(self, spot: dict) -> tuple:
+        """(hourly rate, multiplier) for a spot document; base rate if it isn't priced yet"""
+        row = self._index.get(spot['id'])
+        if row is None or self._base[row] != spot['rate_per_hour']:
+            return spot['rate_per_hour'], 1.0
+        return float(self._rates[row]), float(self._multipliers[self._lot_of[row]])
+
+    def rate_changes(self, previous: np.ndarray) -> dict:
+        """{spot id: current rate} for the rows whose rate differs from previous"""
+        return {self._ids[row]: float(self._rates[row]) for row in np.flatnonzero(self._rates != previous)}
+
+    def decorate(self, spot: dict) -> dict:
+        rate, multiplier = self.quote(spot)
+        return {**spot, "current_rate": rate, "surge_multiplier": multiplier}
+
+    async def refresh(self):
+        if self._catalog_stale:
+            spots = await db.spots.find({}, {"_id": 0, "id": 1, "lot_id": 1, "rate_per_hour": 1}).to_list(None)
+            self.load_catalog(spots)
+        previous = self._rates
+        lots = await db.lot_stats.find({}, {"_id": 0, "lot_id": 1, "total": 1, "available": 1}).to_list(None)
+        if self.reprice(lots):
+            # Each worker reprices itself, so only its own cached bodies and
+            # map subscribers need the new rates
+            for namespace in ("spots", "spot"):
+                response_cache.apply({"namespace": namespace, "key": None})
+            spot_hub.push_rates(self.rate_changes(previous))
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Repricing failed: {e}")
+            await asyncio.sleep(interval)
+
+pricing = PricingEngine()
+PRICING_INTERVAL = float(os.environ.get('PRICING_INTERVAL', '30'))
+
 # ============ PAYMENTS ============
 
 class PaymentOrder(BaseModel):
     booking_id: str
 
-@api_router.post("/payments/create-order")
+@api_router.post("/payments/create-order", dependencies=[rate_limited("payments")])
 async def create_payment_order(order: PaymentOrder, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_current_user(request, session_token)
     if not user:
         raise HTTPException(401, "Not authenticated")
     
-    booking = await db.bookings.find_one({"id": order.booking_id}, {"_id": 0})
+    booking = await db.bookings.find_one({"id": order.booking_id, "user_id": user.id}, {"_id": 0})
     if not booking:
         raise HTTPException(404, "Booking not found")
+    if booking['status'] != "pending":
+        raise HTTPException(409, f"Booking is {booking['status']}")
     
     # Mock Razorpay order (test mode)
     razorpay_order_id = f"order_mock_{uuid.uuid4().hex[:12]}"
@@ -340,9 +1621,11 @@ async def create_payment_order(order: PaymentOrder, request: Request, session_to
         status="pending"
     )
     
-    trans_dict = transaction.model_dump()
-    trans_dict['created_at'] = trans_dict['created_at'].isoformat()
-    await db.transactions.insert_one(trans_dict)
+    await db.transactions.insert_one(to_document(transaction))
+    await db.rewards.update_one(
+        {"user_id": user.id},
+        {"$push": {"recent_transaction_ids": {"$each": [transaction.id], "$position": 0, "$slice": RECENT_TRANSACTIONS}}}
+    )
     
     return {
         "order_id": razorpay_order_id,
@@ -356,36 +1639,383 @@ class PaymentVerify(BaseModel):
     razorpay_order_id: str
     booking_id: str
 
-@api_router.post("/payments/verify")
+def draw_award() -> tuple:
+    """(points, carbon kg) for one completed payment"""
+    return random.randint(10, 30), round(random.uniform(0.5, 2.0), 2)
+
+def settlement(payment_id: str, points: int, carbon: float, settlement_id: str) -> dict:
+    """$set that completes a pending transaction and records what it earned.
+
+    Storing the award on the transaction lets a retried callback replay
+    the original outcome instead of awarding again.
+    """
+    return {
+        "status": "completed",
+        "razorpay_payment_id": payment_id,
+        "points_earned": points,
+        "carbon_saved": carbon,
+        "settlement_id": settlement_id,
+        "settled_at": datetime.now(timezone.utc).isoformat(),
+        # Follow-up writes still owed; see finish_settlement
+        "booking_activated": False,
+        "rewarded": False
+    }
+
+SETTLEMENT_REFUSED = "Booking is no longer pending; the payment is due a refund"
+
+async def finish_settlement(transaction: dict, user: Optional[User] = None) -> bool:
+    """Apply whichever follow-up writes of a claimed settlement haven't landed.
+
+    The claim, the booking and the reward live in different documents, so
+    a crash can stop between them. Both steps are idempotent and the
+    transaction is marked once they are done, so a replayed callback
+    finishes the job. Settlements from before the markers existed count
+    as done. Returns False if the booking can no longer take the payment;
+    the captured payment is then left refund_due.
+    """
+    if transaction.get('booking_activated', True) and transaction.get('rewarded', True):
+        return True
+    order_id, settlement_id = transaction['razorpay_order_id'], transaction['settlement_id']
+    
+    # The booking must still be pending: the sweeper may have cancelled it and
+    # released its spot, or another order may already have paid for it
+    activated = await db.bookings.update_one(
+        {"id": transaction['booking_id'], "status": "pending"},
+        {"$set": {"status": "active", "settlement_id": settlement_id}}
+    )
+    if not activated.matched_count and not await db.bookings.find_one(
+        {"id": transaction['booking_id'], "settlement_id": settlement_id}, {"_id": 1}
+    ):
+        await db.transactions.update_one(
+            {"razorpay_order_id": order_id, "settlement_id": settlement_id},
+            {"$set": {"status": "refund_due"}}
+        )
+        return False
+    
+    reward = await db.rewards.find_one_and_update(
+        {"user_id": transaction['user_id'], "settled_orders": {"$ne": order_id}},
+        award_update(transaction['points_earned'], transaction['carbon_saved'], transaction['settled_at'][:7], order_id),
+        projection={"_id": 0, "recent_transaction_ids": 0, "settled_orders": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    await db.transactions.update_one(
+        {"razorpay_order_id": order_id, "settlement_id": settlement_id},
+        {"$set": {"booking_activated": True, "rewarded": True}}
+    )
+    if reward and user:
+        leaderboard_cache.observe(user, reward)
+    return True
+
+@api_router.post("/payments/verify", dependencies=[rate_limited("payments")])
 async def verify_payment(payment: PaymentVerify, request: Request, session_token: Optional[str] = Cookie(None)):
+    """Settle one order; the gateway order id is the idempotency key"""
     user = await get_current_user(request, session_token)
     if not user:
         raise HTTPException(401, "Not authenticated")
     
-    # Update transaction
-    await db.transactions.update_one(
-        {"razorpay_order_id": payment.razorpay_order_id},
-        {"$set": {"razorpay_payment_id": payment.razorpay_payment_id, "status": "completed"}}
-    )
-    
-    # Update booking
-    await db.bookings.update_one(
-        {"id": payment.booking_id},
-        {"$set": {"status": "active"}}
+    # Claim the pending transaction: only one verification of an order can win
+    points, carbon = draw_award()
+    settlement_id = str(uuid.uuid4())
+    transaction = await db.transactions.find_one_and_update(
+        {
+            "razorpay_order_id": payment.razorpay_order_id,
+            "booking_id": payment.booking_id,
+            "user_id": user.id,
+            "status": "pending"
+        },
+        {"$set": settlement(payment.razorpay_payment_id, points, carbon, settlement_id)},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    if not transaction:
+        existing = await db.transactions.find_one({"razorpay_order_id": payment.razorpay_order_id}, {"_id": 0})
+        if not existing or existing['user_id'] != user.id:
+            raise HTTPException(404, "Order not found")
+        if existing['booking_id'] != payment.booking_id:
+            raise HTTPException(400, "Order does not belong to this booking")
+        if existing['status'] == "completed" and existing.get('razorpay_payment_id') == payment.razorpay_payment_id:
+            # A retry of a verification that went through, or stopped part-way
+            if not await finish_settlement(existing, user):
+                raise HTTPException(409, SETTLEMENT_REFUSED)
+            return {
+                "success": True,
+                "points_earned": existing.get('points_earned', 0),
+                "carbon_saved": existing.get('carbon_saved', 0.0),
+                "replayed": True
+            }
+        raise HTTPException(409, f"Order is already {existing['status']}")
     
-    # Award points
-    points = random.randint(10, 30)
-    carbon = round(random.uniform(0.5, 2.0), 2)
-    await db.rewards.update_one(
-        {"user_id": user.id},
-        {"$inc": {"points": points, "carbon_saved": carbon}}
-    )
+    if not await finish_settlement(transaction, user):
+        raise HTTPException(409, SETTLEMENT_REFUSED)
     
     return {"success": True, "points_earned": points, "carbon_saved": carbon}
 
+class GatewayPayment(BaseModel):
+    razorpay_order_id: str
+    razorpay_payment_id: str
+    booking_id: Optional[str] = None
+
+class ReconcileRequest(BaseModel):
+    payments: List[GatewayPayment] = Field(max_length=10000)
+
+@api_router.post("/payments/reconcile")
+async def reconcile_payments(batch: ReconcileRequest, request: Request):
+    """Settle a batch of gateway payment callbacks with one bulk write per collection.
+
+    Already-settled orders with the same payment id are reported as
+    duplicates and only finish follow-up writes an earlier attempt left
+    undone, so a batch can safely be resent.
+    """
+    secret = os.environ.get('PAYMENT_WEBHOOK_SECRET')
+    if not secret:
+        raise HTTPException(503, "Payment reconciliation is not configured")
+    if not hmac.compare_digest(request.headers.get('X-Webhook-Secret', ''), secret):
+        raise HTTPException(401, "Invalid webhook secret")
+    
+    payments = {p.razorpay_order_id: p for p in batch.payments}
+    transactions = await db.transactions.find(
+        {"razorpay_order_id": {"$in": list(payments)}}, {"_id": 0}
+    ).to_list(None)
+    found = {t['razorpay_order_id']: t for t in transactions}
+    
+    settlement_id = str(uuid.uuid4())
+    rejected, duplicates, claims, claimed = [], [], [], []
+    for order_id, payment in payments.items():
+        transaction = found.get(order_id)
+        if not transaction:
+            rejected.append({"razorpay_order_id": order_id, "reason": "order not found"})
+        elif payment.booking_id and payment.booking_id != transaction['booking_id']:
+            rejected.append({"razorpay_order_id": order_id, "reason": "order does not belong to this booking"})
+        elif transaction['status'] == "completed" and transaction.get('razorpay_payment_id') == payment.razorpay_payment_id:
+            if await finish_settlement(transaction):
+                duplicates.append(order_id)
+            else:
+                rejected.append({"razorpay_order_id": order_id, "reason": "booking is no longer pending"})
+        elif transaction['status'] != "pending":
+            rejected.append({"razorpay_order_id": order_id, "reason": f"order is already {transaction['status']}"})
+        else:
+            points, carbon = draw_award()
+            claimed.append(order_id)
+            claims.append(UpdateOne(
+                {"razorpay_order_id": order_id, "status": "pending"},
+                {"$set": settlement(payment.razorpay_payment_id, points, carbon, settlement_id)}
+            ))
+    if claims:
+        await db.transactions.bulk_write(claims, ordered=False)
+    
+    # Claims that raced with a concurrent verification lost; see which ones this batch won
+    settled = await db.transactions.find(
+        {"settlement_id": settlement_id},
+        {"_id": 0, "razorpay_order_id": 1, "booking_id": 1, "user_id": 1, "points_earned": 1, "carbon_saved": 1, "settled_at": 1}
+    ).to_list(None) if claims else []
+    won = {t['razorpay_order_id'] for t in settled}
+    rejected += [
+        {"razorpay_order_id": order_id, "reason": "settled concurrently"}
+        for order_id in claimed if order_id not in won
+    ]
+    
+    if settled:
+        await db.bookings.bulk_write([
+            UpdateOne(
+                {"id": t['booking_id'], "status": "pending"},
+                {"$set": {"status": "active", "settlement_id": settlement_id}}
+            ) for t in settled
+        ], ordered=False)
+        activated = {b['id'] for b in await db.bookings.find(
+            {"id": {"$in": [t['booking_id'] for t in settled]}, "settlement_id": settlement_id},
+            {"_id": 0, "id": 1}
+        ).to_list(None)}
+        # One order per activated booking keeps its settlement; the rest were
+        # captured for a booking that can't take them and are owed back
+        paid = {}
+        for transaction in settled:
+            if transaction['booking_id'] in activated:
+                paid.setdefault(transaction['booking_id'], transaction['razorpay_order_id'])
+        kept = set(paid.values())
+        stale = [t['razorpay_order_id'] for t in settled if t['razorpay_order_id'] not in kept]
+        if stale:
+            await db.transactions.update_many(
+                {"razorpay_order_id": {"$in": stale}, "settlement_id": settlement_id},
+                {"$set": {"status": "refund_due"}}
+            )
+            rejected += [{"razorpay_order_id": order_id, "reason": "booking is no longer pending"} for order_id in stale]
+        settled = [t for t in settled if t['razorpay_order_id'] in kept]
+    
+    if settled:
+        # One award per order, keyed so a resent batch can't apply it twice
+        await db.rewards.bulk_write([
+            UpdateOne(
+                {"user_id": t['user_id'], "settled_orders": {"$ne": t['razorpay_order_id']}},
+                award_update(t['points_earned'], t['carbon_saved'], t['settled_at'][:7], t['razorpay_order_id'])
+            ) for t in settled
+        ], ordered=False)
+        await db.transactions.update_many(
+            {"razorpay_order_id": {"$in": [t['razorpay_order_id'] for t in settled]}, "settlement_id": settlement_id},
+            {"$set": {"booking_activated": True, "rewarded": True}}
+        )
+        leaderboard_cache.invalidate()
+    
+    return {"settled": len(settled), "duplicates": duplicates, "rejected": rejected}
+
 # ============ REWARDS ============
 
+LEVELS = [(500, "Green Hero"), (200, "Silver Saver"), (50, "Bronze Member")]
+DEFAULT_LEVEL = "Eco Starter"
+POINTS_PER_RUPEE = 10  # wallet conversion rate
+RECENT_TRANSACTIONS = 100
+MONTHS_KEPT = 12
+SETTLED_ORDERS_KEPT = 50  # order ids remembered to make awards idempotent
+
+def level_for_points(points: int) -> str:
+    for threshold, level in LEVELS:
+        if points >= threshold:
+            return level
+    return DEFAULT_LEVEL
+
+# Pipeline stage deriving balance and level from points, inside the same update
+DERIVED_SUMMARY = {"$set": {
+    "balance": {"$divide": [{"$ifNull": ["$points", 0]}, POINTS_PER_RUPEE]},
+    "level": {"$switch": {
+        "branches": [{"case": {"$gte": [{"$ifNull": ["$points", 0]}, threshold]}, "then": level} for threshold, level in LEVELS],
+        "default": DEFAULT_LEVEL
+    }}
+}}
+
+def award_update(points: int, carbon: float, month: str, order_id: Optional[str] = None) -> List[dict]:
+    """Update pipeline folding one award into the reward summary atomically.
+
+    With order_id, the order is remembered in settled_orders so callers
+    can filter on it and never fold the same order in twice.
+    """
+    months = {"$ifNull": ["$monthly_carbon", []]}
+    settled = {}
+    if order_id:
+        settled['settled_orders'] = {"$slice": [
+            {"$concatArrays": [{"$ifNull": ["$settled_orders", []]}, [order_id]]}, -SETTLED_ORDERS_KEPT
+        ]}
+    return [
+        {"$set": {
+            **settled,
+            "points": {"$add": [{"$ifNull": ["$points", 0]}, points]},
+            "carbon_saved": {"$add": [{"$ifNull": ["$carbon_saved", 0]}, carbon]},
+            "monthly_carbon": {"$slice": [
+                {"$cond": [
+                    {"$in": [month, {"$map": {"input": months, "as": "m", "in": "$$m.month"}}]},
+                    {"$map": {"input": months, "as": "m", "in": {"$cond": [
+                        {"$eq": ["$$m.month", month]},
+                        {"month": "$$m.month", "carbon": {"$add": ["$$m.carbon", carbon]}},
+                        "$$m"
+                    ]}}},
+                    {"$concatArrays": [months, [{"month": month, "carbon": carbon}]]}
+                ]},
+                -MONTHS_KEPT
+            ]}
+        }},
+        DERIVED_SUMMARY
+    ]
+
+class LeaderboardCache:
+    """Materialized top-N leaderboard, refreshed incrementally on point awards"""
+
+    def __init__(self, size: int = 10, ttl: float = 300.0):
+        self.size = size
+        self.ttl = ttl
+        self._entries: Optional[List[dict]] = None
+        self._loaded_at = 0.0
+
+    def _fresh(self) -> bool:
+        return self._entries is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def get(self) -> List[dict]:
+        if not self._fresh():
+            await self.reload()
+        return self._entries
+
+    async def reload(self):
+        # Top-N straight off the rewards.points index, users joined in the same query
+        pipeline = [
+            {"$sort": {"points": -1}},
+            {"$limit": self.size},
+            {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "user"}},
+            {"$unwind": "$user"},
+            {"$project": {
+                "_id": 0,
+                "user_id": 1,
+                "name": "$user.name",
+                "picture": "$user.picture",
+                "points": 1,
+                "carbon_saved": 1
+            }}
+        ]
+        rows = await db.rewards.aggregate(pipeline).to_list(self.size)
+        entries = []
+        for row in rows:
+            points = row.get('points', 0)
+            entries.append({
+                "user_id": row['user_id'],
+                "name": row['name'],
+                "picture": row.get('picture'),
+                "points": points,
+                "level": level_for_points(points),
+                "carbon_saved": row.get('carbon_saved', 0)
+            })
+        self._entries = entries
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        shared_state.emit("leaderboard", {"op": "invalidate"})
+
+    def observe(self, user: User, reward: dict):
+        shared_state.emit("leaderboard", {
+            "op": "observe",
+            "user_id": user.id,
+            "name": user.name,
+            "picture": user.picture,
+            "points": reward.get('points', 0),
+            "carbon_saved": reward.get('carbon_saved', 0)
+        })
+
+    def rename(self, user_id: str, name: str):
+        shared_state.emit("leaderboard", {"op": "rename", "user_id": user_id, "name": name})
+
+    def apply(self, message: dict):
+        if message['op'] == "invalidate":
+            self._entries = None
+        elif message['op'] == "rename":
+            for entry in self._entries or []:
+                if entry['user_id'] == message['user_id']:
+                    entry['name'] = message['name']
+        else:
+            self._fold(message)
+
+    def _fold(self, update: dict):
+        """Fold a user's updated reward totals into the cached top-N.
+
+        Points only ever increase, so the only way the top-N can change is
+        for this user to move up within it or enter it.
+        """
+        if self._entries is None:
+            return
+        points = update['points']
+        entry = next((e for e in self._entries if e['user_id'] == update['user_id']), None)
+        if entry is None:
+            if len(self._entries) >= self.size and points <= self._entries[-1]['points']:
+                return
+            entry = {"user_id": update['user_id']}
+            self._entries.append(entry)
+        entry.update({
+            "name": update['name'],
+            "picture": update['picture'],
+            "points": points,
+            "level": level_for_points(points),
+            "carbon_saved": update['carbon_saved']
+        })
+        self._entries.sort(key=lambda e: e['points'], reverse=True)
+        del self._entries[self.size:]
+
+leaderboard_cache = LeaderboardCache(ttl=float(os.environ.get('LEADERBOARD_TTL', '300')))
+shared_state.subscribe("leaderboard", leaderboard_cache.apply)
+
 @api_router.get("/rewards/me")
 async def get_my_rewards(request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_current_user(request, session_token)
@@ -396,65 +2026,61 @@ async def get_my_rewards(request: Request, session_token: Optional[str] = Cookie
     if not reward:
         reward = Reward(user_id=user.id).model_dump()
         await db.rewards.insert_one(reward)
+        reward.pop('_id', None)
     
-    # Update level based on points
-    points = reward.get('points', 0)
-    if points >= 500:
-        level = "Green Hero"
-    elif points >= 200:
-        level = "Silver Saver"
-    elif points >= 50:
-        level = "Bronze Member"
-    else:
-        level = "Eco Starter"
-    
-    reward['level'] = level
+    reward.pop('recent_transaction_ids', None)
+    reward.pop('settled_orders', None)
     return reward
 
 @api_router.get("/rewards/leaderboard")
 async def get_leaderboard():
-    rewards = await db.rewards.find({}, {"_id": 0}).to_list(100)
-    
-    # Sort by points
-    sorted_rewards = sorted(rewards, key=lambda x: x.get('points', 0), reverse=True)[:10]
-    
-    # Enrich with user data
-    leaderboard = []
-    for reward in sorted_rewards:
-        user = await db.users.find_one({"id": reward['user_id']}, {"_id": 0})
-        if user:
-            leaderboard.append({
-                "name": user['name'],
-                "picture": user.get('picture'),
-                "points": reward.get('points', 0),
-                "level": reward.get('level', 'Eco Starter'),
-                "carbon_saved": reward.get('carbon_saved', 0)
-            })
-    
-    return leaderboard
+    entries = await leaderboard_cache.get()
+    return ORJSONResponse([{k: v for k, v in entry.items() if k != 'user_id'} for entry in entries])
 
 # ============ HISTORY ============
 
-@api_router.get("/history")
-async def get_history(request: Request, session_token: Optional[str] = Cookie(None)):
+@api_router.get("/history", dependencies=[rate_limited("history")])
+async def get_history(
+    request: Request,
+    before: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=100),
+    session_token: Optional[str] = Cookie(None)
+):
     user = await get_current_user(request, session_token)
     if not user:
         raise HTTPException(401, "Not authenticated")
     
-    bookings = await db.bookings.find({"user_id": user.id}, {"_id": 0}).sort("created_at", -1).to_list(100)
+    match = {"user_id": user.id}
+    if before:
+        match['created_at'] = {"$lt": before}
+    
+    # Join spot and transaction server-side in a single round-trip
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"created_at": -1}},
+        {"$limit": limit},
+        {"$lookup": {"from": "spots", "localField": "spot_id", "foreignField": "id", "as": "spot"}},
+        {"$lookup": {"from": "transactions", "localField": "id", "foreignField": "booking_id", "as": "transaction"}},
+        {"$project": {"_id": 0, "spot._id": 0, "transaction._id": 0}}
+    ]
+    rows = await db.bookings.aggregate(pipeline).to_list(limit)
     
     history = []
-    for booking in bookings:
-        spot = await db.spots.find_one({"id": booking['spot_id']}, {"_id": 0})
-        transaction = await db.transactions.find_one({"booking_id": booking['id']}, {"_id": 0})
-        
+    for row in rows:
+        spot = row.pop('spot')
+        transaction = row.pop('transaction')
         history.append({
-            "booking": booking,
-            "spot": spot,
-            "transaction": transaction
+            "booking": row,
+            "spot": spot[0] if spot else None,
+            "transaction": transaction[0] if transaction else None
         })
     
-    return history
+    # Cursor for the next page: pass back as ?before=
+    headers = {}
+    if len(rows) == limit:
+        headers['X-Next-Before'] = rows[-1]['created_at']
+    
+    return ORJSONResponse(history, headers=headers)
 
 # ============ WALLET ============
 
@@ -464,16 +2090,25 @@ async def get_wallet(request: Request, session_token: Optional[str] = Cookie(Non
     if not user:
         raise HTTPException(401, "Not authenticated")
     
-    transactions = await db.transactions.find({"user_id": user.id}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    reward = await db.rewards.find_one({"user_id": user.id}, {"_id": 0})
+    reward = await db.rewards.find_one(
+        {"user_id": user.id},
+        {"_id": 0, "balance": 1, "points": 1, "recent_transaction_ids": 1}
+    ) or {}
+    summary = {
+        "balance": reward.get('balance', 0),
+        "points": reward.get('points', 0)
+    }
     
-    balance = reward.get('points', 0) * 0.1 if reward else 0
+    # NDJSON: the summary line first, then every transaction
+    if wants_ndjson(request):
+        cursor = db.transactions.find({"user_id": user.id}, {"_id": 0}).sort("created_at", -1)
+        return ndjson_response(cursor, header=summary)
     
-    return {
-        "balance": round(balance, 2),
-        "points": reward.get('points', 0) if reward else 0,
-        "transactions": transactions
-    }
+    recent_ids = reward.get('recent_transaction_ids', [])
+    transactions = await db.transactions.find({"id": {"$in": recent_ids}}, {"_id": 0}).to_list(len(recent_ids))
+    order = {txn_id: i for i, txn_id in enumerate(recent_ids)}
+    summary['transactions'] = sorted(transactions, key=lambda t: order[t['id']])
+    return ORJSONResponse(summary)
 
 # ============ PROFILE ============
 
@@ -496,15 +2131,168 @@ async def update_profile(profile_data: ProfileUpdate, request: Request, session_
     update_data = {k: v for k, v in profile_data.model_dump().items() if v is not None}
     if update_data:
         await db.users.update_one({"id": user.id}, {"$set": update_data})
+        session_cache.invalidate_user(user.id)
+        if 'name' in update_data:
+            leaderboard_cache.rename(user.id, update_data['name'])
     
     return {"success": True}
 
 # ============ SHARED SPACES ============
 
 @api_router.get("/shared-spaces")
-async def get_shared_spaces():
-    spaces = await db.shared_spaces.find({"available": True}, {"_id": 0}).to_list(100)
-    return spaces
+async def get_shared_spaces(request: Request):
+    if wants_ndjson(request):
+        return ndjson_response(db.shared_spaces.find({"available": True}, {"_id": 0}))
+    
+    async def load():
+        return await bounded_list(db.shared_spaces.find({"available": True}, {"_id": 0}), 100)
+    
+    return await response_cache.respond(request, "shared_spaces", None, load)
+
+# Only what the marketplace card renders
+SPACE_CARD_FIELDS = {"_id": 0, "id": 1, "name": 1, "slot_type": 1, "rate_per_hour": 1}
+# Keyset orders; the trailing id makes every position unique
+SPACE_SORTS = {
+    "newest": [("created_at", -1), ("id", -1)],
+    "price": [("rate_per_hour", 1), ("id", 1)],
+    "distance": [("distance_m", 1), ("id", 1)],
+}
+EARTH_RADIUS_M = 6378100
+
+def encode_cursor(sort: str, values: list) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([sort, *values])).decode().rstrip("=")
+
+# Cursor values go straight into queries, so each must have its field's type
+CURSOR_FIELD_TYPES = {"created_at": str, "rate_per_hour": (int, float), "distance_m": (int, float), "id": str}
+
+def decode_cursor(cursor: str, sort: str) -> list:
+    try:
+        payload = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    if not isinstance(payload, list) or not payload:
+        raise HTTPException(400, "Invalid cursor")
+    name, *values = payload
+    if name != sort or len(values) != len(SPACE_SORTS[sort]):
+        raise HTTPException(400, "Cursor belongs to a different sort order")
+    for (field, _), value in zip(SPACE_SORTS[sort], values):
+        if isinstance(value, bool) or not isinstance(value, CURSOR_FIELD_TYPES[field]):
+            raise HTTPException(400, "Invalid cursor")
+    return values
+
+def keyset_filter(sort: str, values: list) -> dict:
+    """Documents strictly after the cursor position in the given sort order"""
+    (first, first_dir), (second, second_dir) = SPACE_SORTS[sort]
+    after = lambda direction: "$gt" if direction == 1 else "$lt"
+    return {"$or": [
+        {first: {after(first_dir): values[0]}},
+        {first: values[0], second: {after(second_dir): values[1]}}
+    ]}
+
+def distance_m(geo: dict, lng: float, lat: float) -> float:
+    """Great-circle distance from (lng, lat) to a GeoJSON point"""
+    lng2, lat2 = (math.radians(v) for v in geo['coordinates'])
+    lng1, lat1 = math.radians(lng), math.radians(lat)
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+def page_response(rows: List[dict], sort: str, limit: int) -> ORJSONResponse:
+    # Cursor for the next page: pass back as ?cursor=
+    headers = {}
+    if len(rows) == limit:
+        headers['X-Next-Cursor'] = encode_cursor(sort, [rows[-1][field] for field, _ in SPACE_SORTS[sort]])
+    return ORJSONResponse(rows, headers=headers)
+
+@api_router.get("/shared-spaces/search", dependencies=[rate_limited("search")])
+async def search_shared_spaces(
+    slot_type: Optional[str] = None,
+    owner_id: Optional[str] = None,
+    min_rate: Optional[float] = Query(None, ge=0),
+    max_rate: Optional[float] = Query(None, ge=0),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius: float = Query(5000, gt=0, le=50000),
+    sort: str = Query("newest", pattern="^(newest|price|distance)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Available shared spaces, filtered and sorted, one page of cards at a time.
+
+    Pages are keyset-based, so every page costs the same index walk no
+    matter how deep it is. Distances are included when lat/lng are given.
+    """
+    if (lat is None) != (lng is None):
+        raise HTTPException(400, "lat and lng go together")
+    if sort == "distance" and lat is None:
+        raise HTTPException(400, "Sorting by distance needs lat and lng")
+    
+    query = {"available": True}
+    if slot_type:
+        query['slot_type'] = slot_type
+    if owner_id:
+        query['owner_id'] = owner_id
+    if min_rate is not None or max_rate is not None:
+        query['rate_per_hour'] = {}
+        if min_rate is not None:
+            query['rate_per_hour']['$gte'] = min_rate
+        if max_rate is not None:
+            query['rate_per_hour']['$lte'] = max_rate
+    after = decode_cursor(cursor, sort) if cursor else None
+    
+    if sort == "distance":
+        geo_near = {
+            "near": {"type": "Point", "coordinates": [lng, lat]},
+            "key": "geo",
+            "distanceField": "distance_m",
+            "maxDistance": radius,
+            "query": query,
+            "spherical": True
+        }
+        pipeline = [{"$geoNear": geo_near}]
+        if after:
+            # Start the index walk at the cursor's distance; ties are settled by id
+            geo_near['minDistance'] = after[0]
+            pipeline.append({"$match": keyset_filter(sort, after)})
+        pipeline += [
+            {"$sort": {"distance_m": 1, "id": 1}},
+            {"$limit": limit},
+            {"$project": {**SPACE_CARD_FIELDS, "distance_m": 1}}
+        ]
+        rows = await db.shared_spaces.aggregate(pipeline).to_list(limit)
+        return page_response(rows, sort, limit)
+    
+    if lat is not None:
+        query['geo'] = {"$geoWithin": {"$centerSphere": [[lng, lat], radius / EARTH_RADIUS_M]}}
+    if after:
+        query = {"$and": [query, keyset_filter(sort, after)]}
+    projection = {**SPACE_CARD_FIELDS, **{field: 1 for field, _ in SPACE_SORTS[sort]}}
+    if lat is not None:
+        projection['geo'] = 1
+    rows = await db.shared_spaces.find(query, projection).sort(SPACE_SORTS[sort]).limit(limit).to_list(limit)
+    if lat is not None:
+        for row in rows:
+            row['distance_m'] = distance_m(row.pop('geo'), lng, lat)
+    return page_response(rows, sort, limit)
+
+@api_router.get("/shared-spaces/mine")
+async def get_my_shared_spaces(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
+    session_token: Optional[str] = Cookie(None)
+):
+    """The host's own listings, available or not, newest first"""
+    user = await get_current_user(request, session_token)
+    if not user:
+        raise HTTPException(401, "Not authenticated")
+    
+    query = {"owner_id": user.id}
+    if cursor:
+        query = {"$and": [query, keyset_filter("newest", decode_cursor(cursor, "newest"))]}
+    rows = await db.shared_spaces.find(
+        query, {**SPACE_CARD_FIELDS, "available": 1, "created_at": 1}
+    ).sort(SPACE_SORTS["newest"]).limit(limit).to_list(limit)
+    return page_response(rows, "newest", limit)
 
 class SharedSpaceCreate(BaseModel):
     name: str
@@ -512,7 +2300,7 @@ class SharedSpaceCreate(BaseModel):
     rate_per_hour: float
     slot_type: str
 
-@api_router.post("/shared-spaces")
+@api_router.post("/shared-spaces", dependencies=[rate_limited("shared-spaces")])
 async def create_shared_space(space_data: SharedSpaceCreate, request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_current_user(request, session_token)
     if not user:
@@ -526,39 +2314,434 @@ async def create_shared_space(space_data: SharedSpaceCreate, request: Request, s
         slot_type=space_data.slot_type
     )
     
-    space_dict = space.model_dump()
-    space_dict['created_at'] = space_dict['created_at'].isoformat()
-    await db.shared_spaces.insert_one(space_dict)
+    space_dict = to_document(space)
+    geo = geo_point(space_dict['location'])
+    await db.shared_spaces.insert_one({**space_dict, "geo": geo} if geo else dict(space_dict))
+    response_cache.invalidate("shared_spaces")
     
-    return space.model_dump()
+    return ORJSONResponse(space_dict)
+
+# ============ SENSOR STORAGE ============
+
+# Readings are kept in one bucket document per spot per hour:
+# {spot_id, lot_id, hour, n, r: [seconds into the hour * len(SPOT_STATUSES) + status code]}
+STATUS_CODES = {status: code for code, status in enumerate(SPOT_STATUSES)}
+SENSOR_RETENTION_DAYS = int(os.environ.get('SENSOR_RETENTION_DAYS', '30'))
+
+def as_utc(ts: datetime) -> datetime:
+    """Motor hands back naive datetimes; they are UTC"""
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Aware UTC datetime for an ISO string or datetime; None if unparseable"""
+    if isinstance(value, datetime):
+        return as_utc(value)
+    try:
+        return as_utc(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        return None
+
+def hour_start(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def bucket_readings(readings: List[dict]) -> dict:
+    """Group readings into {(spot_id, hour): [packed reading]}"""
+    buckets = {}
+    for reading in readings:
+        ts = parse_timestamp(reading['timestamp'])
+        if ts is None:
+            continue
+        offset = ts.minute * 60 + ts.second
+        buckets.setdefault((reading['spot_id'], hour_start(ts)), []).append(
+            offset * len(SPOT_STATUSES) + STATUS_CODES[reading['status']]
+        )
+    return buckets
+
+def bucket_writes(readings: List[dict], lot_of: dict) -> List[UpdateOne]:
+    """One upsert per (spot, hour) appending that hour's readings to its bucket"""
+    return [
+        UpdateOne(
+            {"spot_id": spot_id, "hour": hour},
+            {
+                "$push": {"r": {"$each": packed}},
+                "$inc": {"n": len(packed)},
+                "$setOnInsert": {"lot_id": lot_of.get(spot_id)}
+            },
+            upsert=True
+        )
+        for (spot_id, hour), packed in bucket_readings(readings).items()
+    ]
+
+class SensorRollup:
+    """Per-lot hourly occupancy in lot_occupancy_hourly, rolled up from buckets.
+
+    Each pass recomputes every hour from the oldest one that isn't complete
+    yet. An hour is complete once a grace period has passed since it closed,
+    so late readings still land in it; the forecaster only reads complete hours.
+    """
+
+    def __init__(self, interval: float, grace: timedelta):
+        self.interval = interval
+        self.grace = grace
+        self._watermark: Optional[datetime] = None
+
+    async def tick(self, now: Optional[datetime] = None) -> int:
+        open_from = hour_start((now or datetime.now(timezone.utc)) - self.grace)
+        if self._watermark is None:
+            latest = await db.lot_occupancy_hourly.find_one({"complete": True}, {"_id": 0, "hour": 1}, sort=[("hour", -1)])
+            if latest:
+                self._watermark = as_utc(latest['hour']) + timedelta(hours=1)
+        match = {"lot_id": {"$ne": None}}
+        if self._watermark:
+            match['hour'] = {"$gte": self._watermark}
+        rows = await db.sensor_buckets.aggregate([
+            {"$match": match},
+            {"$project": {
+                "lot_id": 1, "hour": 1, "n": 1,
+                "occupied": {"$size": {"$filter": {
+                    "input": "$r",
+                    "cond": {"$ne": [{"$mod": ["$$this", len(SPOT_STATUSES)]}, STATUS_CODES['available']]}
+                }}}
+            }},
+            {"$group": {
+                "_id": {"lot_id": "$lot_id", "hour": "$hour"},
+                "readings": {"$sum": "$n"},
+                "occupied": {"$sum": "$occupied"},
+                "spots": {"$sum": 1}
+            }}
+        ]).to_list(None)
+        writes = []
+        for row in rows:
+            key = {"lot_id": row['_id']['lot_id'], "hour": as_utc(row['_id']['hour'])}
+            writes.append(ReplaceOne(key, {
+                **key,
+                "readings": row['readings'],
+                "occupied": row['occupied'],
+                "spots": row['spots'],
+                "occupancy": round(row['occupied'] / row['readings'], 4) if row['readings'] else 0.0,
+                "complete": key['hour'] < open_from
+            }, upsert=True))
+        if writes:
+            await db.lot_occupancy_hourly.bulk_write(writes, ordered=False)
+        self._watermark = open_from
+        return len(writes)
+
+    async def run(self):
+        while True:
+            try:
+                if await shared_state.leads("sensor-rollup", ttl=self.interval * 3):
+                    await self.tick()
+            except Exception as e:
+                logger.error(f"Sensor rollup failed: {e}")
+            await asyncio.sleep(self.interval)
+
+sensor_rollup = SensorRollup(
+    interval=float(os.environ.get('SENSOR_ROLLUP_INTERVAL', '300')),
+    grace=timedelta(minutes=float(os.environ.get('SENSOR_ROLLUP_GRACE_MINUTES', '15')))
+)
+
+@api_router.get("/lots/{lot_id}/occupancy")
+async def get_lot_occupancy(
+    lot_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(168, ge=1, le=24 * 90)
+):
+    """Hourly occupancy for one lot, newest first"""
+    query = {"lot_id": lot_id}
+    if since or until:
+        query['hour'] = {}
+        if since:
+            query['hour']['$gte'] = as_utc(since)
+        if until:
+            query['hour']['$lt'] = as_utc(until)
+    rows = await db.lot_occupancy_hourly.find(query, {"_id": 0}).sort("hour", -1).to_list(limit)
+    for row in rows:
+        row['hour'] = as_utc(row['hour'])
+    return ORJSONResponse(rows)
+
+# ============ IOT INGESTION ============
+
+SENSOR_STATUSES = {'available', 'occupied', 'soon_available'}
+SENSOR_MAX_BODY_BYTES = int(os.environ.get('SENSOR_MAX_BODY_BYTES', str(1024 * 1024)))
+
+def sensor_transition(current: str, reported: str) -> bool:
+    """Whether a reading may move a spot from its current status.
+
+    A reservation is held for a paying driver who may not have arrived
+    yet, so an empty bay doesn't release it; only the car parking
+    (occupied) moves it on.
+    """
+    if current == reported:
+        return False
+    return current != 'reserved' or reported == 'occupied'
+
+async def apply_sensor_readings(readings: List[dict]):
+    """Write a batch of readings: one read of current status, then bulk writes.
+
+    Readings that don't change a spot's status, or that would clear a
+    reservation, are only appended to the sensor buckets. Updates
+    are conditional on the status that was read, so per-lot counters only
+    move for transitions that really happened.
+    """
+    if not readings:
+        return
+    spots = await db.spots.find(
+        {"id": {"$in": [r['spot_id'] for r in readings]}},
+        {"_id": 0, "id": 1, "status": 1, "lot_id": 1, "ev_charging": 1}
+    ).to_list(None)
+    current = {spot['id']: spot for spot in spots}
+    changes = [
+        (current[r['spot_id']], r['status']) for r in readings
+        if r['spot_id'] in current and sensor_transition(current[r['spot_id']]['status'], r['status'])
+    ]
+    if changes:
+        result = await db.spots.bulk_write(
+            [UpdateOne({"id": spot['id'], "status": spot['status']}, {"$set": {"status": status}}) for spot, status in changes],
+            ordered=False
+        )
+        await settle_lot_transitions(changes, result.modified_count)
+    buckets = bucket_writes(readings, {spot['id']: spot.get('lot_id') for spot in spots})
+    if buckets:
+        await db.sensor_buckets.bulk_write(buckets, ordered=False)
+    if changes:
+        invalidate_spots([spot['id'] for spot, _ in changes])
+        spot_hub.publish([{"id": spot['id'], "status": status} for spot, status in changes])
+
+class SensorIngestor:
+    """Coalesces submitted readings and flushes them on a size-or-time trigger.
+
+    Within one window only the latest reading per spot is kept, so a
+    chattering sensor costs a single write per flush.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size: int = 5000, max_delay: float = 0.05, queue_size: int = 1000):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            await self._queue.put(self._STOP)
+            await self._task
+
+    async def submit(self, readings: List[dict]):
+        # Blocks when the queue is full, pushing backpressure onto the sender
+        self.start()
+        await self._queue.put(readings)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        pending = {}
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if pending else None
+            try:
+                batch = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                batch = None
+            if batch is self._STOP:
+                await self._flush(pending)
+                return
+            if batch:
+                if not pending:
+                    deadline = loop.time() + self.max_delay
+                # Timestamps are parsed UTC datetimes, so offsets compare correctly
+                for reading in batch:
+                    current = pending.get(reading['spot_id'])
+                    if current is None or reading['timestamp'] >= current['timestamp']:
+                        pending[reading['spot_id']] = reading
+            if pending and (len(pending) >= self.batch_size or loop.time() >= deadline):
+                await self._flush(pending)
+                pending = {}
+
+    async def _flush(self, pending: dict):
+        if not pending:
+            return
+        try:
+            await apply_sensor_readings(list(pending.values()))
+            self.flushed += len(pending)
+        except Exception as e:
+            logger.error(f"Sensor flush of {len(pending)} readings failed: {e}")
+
+sensor_ingestor = SensorIngestor(
+    batch_size=int(os.environ.get('SENSOR_BATCH_SIZE', '5000')),
+    max_delay=float(os.environ.get('SENSOR_FLUSH_INTERVAL', '0.05'))
+)
+
+def _parse_reading(item, received_at: datetime) -> dict:
+    # Compact form: [spot_id, status] or [spot_id, status, timestamp]
+    if isinstance(item, list):
+        item = dict(zip(("spot_id", "status", "timestamp"), item))
+    if not isinstance(item, dict) or not isinstance(item.get('spot_id'), str):
+        raise HTTPException(400, "Each reading needs a spot_id")
+    if item.get('status') not in SENSOR_STATUSES:
+        raise HTTPException(400, f"Invalid status for spot {item['spot_id']}")
+    timestamp = received_at
+    if item.get('timestamp') is not None:
+        timestamp = parse_timestamp(item['timestamp'])
+        if timestamp is None:
+            raise HTTPException(400, f"Invalid timestamp for spot {item['spot_id']}")
+    return {
+        "spot_id": item['spot_id'],
+        "status": item['status'],
+        "timestamp": timestamp
+    }
+
+@api_router.post("/sensors/readings", status_code=202, dependencies=[rate_limited("sensor-readings")])
+async def ingest_sensor_readings(request: Request):
+    """Accept a batch of readings as NDJSON or a JSON array from a sensor gateway"""
+    key = os.environ.get('SENSOR_API_KEY')
+    if not key:
+        raise HTTPException(503, "Sensor ingestion is not configured")
+    if not hmac.compare_digest(request.headers.get('X-Sensor-Key', ''), key):
+        raise HTTPException(401, "Invalid sensor key")
+    
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > SENSOR_MAX_BODY_BYTES:
+            raise HTTPException(413, "Readings payload too large")
+    try:
+        if 'ndjson' in request.headers.get('Content-Type', ''):
+            items = [orjson.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = orjson.loads(body)
+            if isinstance(items, dict):
+                items = items.get('readings', [])
+    except ValueError:
+        raise HTTPException(400, "Malformed readings payload")
+    if not isinstance(items, list):
+        raise HTTPException(400, "Expected a list of readings")
+    
+    received_at = datetime.now(timezone.utc)
+    readings = [_parse_reading(item, received_at) for item in items]
+    await sensor_ingestor.submit(readings)
+    return {"accepted": len(readings)}
 
 # ============ IOT SIMULATION ============
 
-@api_router.post("/simulate-iot")
+@api_router.post("/simulate-iot", dependencies=[rate_limited("simulate-iot")])
 async def simulate_iot_update():
     """Simulate random IoT sensor updates"""
-    spots = await db.spots.find({}, {"_id": 0}).to_list(1000)
-    
-    for spot in spots:
-        if random.random() < 0.1:  # 10% chance of status change
-            new_status = random.choice(['available', 'occupied', 'soon_available'])
-            await db.spots.update_one(
-                {"id": spot['id']},
-                {"$set": {"status": new_status}}
-            )
-            
-            # Log sensor event
-            await db.sensor_events.insert_one({
-                "spot_id": spot['id'],
-                "status": new_status,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            })
+    spots = await db.spots.find({}, {"_id": 0, "id": 1}).to_list(1000)
+    
+    timestamp = datetime.now(timezone.utc).isoformat()
+    readings = [
+        {"spot_id": spot['id'], "status": random.choice(['available', 'occupied', 'soon_available']), "timestamp": timestamp}
+        for spot in spots
+        if random.random() < 0.1  # 10% chance of status change
+    ]
+    await apply_sensor_readings(readings)
     
     return {"message": "IoT simulation updated"}
 
+# ============ RESERVATION EXPIRY ============
+
+class ReservationSweeper:
+    """Periodically settles bookings that are past due.
+
+    Pending bookings not paid within the hold window are cancelled, and
+    active bookings past end_time are completed. Both release their spot
+    if it is still reserved by them, and orders still open on a cancelled booking
+    are expired so they can no longer be paid. Each tick costs one indexed
+    scan per case, plus one bulk_write on bookings and one on spots.
+    """
+
+    def __init__(self, hold_minutes: float = 15, interval: float = 30, batch_size: int = 1000):
+        self.hold = timedelta(minutes=hold_minutes)
+        self.interval = interval
+        self.batch_size = batch_size
+
+    async def tick(self) -> dict:
+        now = datetime.now(timezone.utc)
+        # Timestamps are stored as UTC ISO strings, which sort chronologically
+        unpaid = await db.bookings.find(
+            {"status": "pending", "created_at": {"$lt": (now - self.hold).isoformat()}},
+            {"_id": 0, "id": 1, "spot_id": 1}
+        ).sort("created_at", 1).to_list(self.batch_size)
+        finished = await db.bookings.find(
+            {"status": "active", "end_time": {"$lt": now.isoformat()}},
+            {"_id": 0, "id": 1, "spot_id": 1}
+        ).sort("end_time", 1).to_list(self.batch_size)
+        if not unpaid and not finished:
+            return {"cancelled": 0, "completed": 0, "released": 0}
+        
+        sweep_id = str(uuid.uuid4())
+        await db.bookings.bulk_write(
+            [UpdateOne({"id": b['id'], "status": "pending"}, {"$set": {"status": "cancelled", "sweep_id": sweep_id}}) for b in unpaid]
+            + [UpdateOne({"id": b['id'], "status": "active"}, {"$set": {"status": "completed", "sweep_id": sweep_id}}) for b in finished],
+            ordered=False
+        )
+        # A booking paid since the scan keeps its spot; see which ones this sweep won
+        swept = await db.bookings.find(
+            {"id": {"$in": [b['id'] for b in unpaid + finished]}, "sweep_id": sweep_id},
+            {"_id": 0, "id": 1, "spot_id": 1, "status": 1}
+        ).to_list(None)
+        cancelled = [b['id'] for b in swept if b['status'] == "cancelled"]
+        if cancelled:
+            await db.transactions.update_many(
+                {"booking_id": {"$in": cancelled}, "status": "pending"}, {"$set": {"status": "expired"}}
+            )
+        
+        # Only spots still reserved by a swept booking are handed back. Sensors may
+        # have moved the rest on, and the spot may since have been booked by
+        # someone else. Claims from before reserved_by existed have no holder.
+        holders = {}
+        for booking in swept:
+            holders.setdefault(booking['spot_id'], set()).add(booking['id'])
+        reserved = [
+            spot for spot in await db.spots.find(
+                {"id": {"$in": list(holders)}, "status": "reserved"},
+                {"_id": 0, "id": 1, "status": 1, "lot_id": 1, "ev_charging": 1, "reserved_by": 1}
+            ).to_list(None)
+            if spot.get('reserved_by') is None or spot['reserved_by'] in holders[spot['id']]
+        ]
+        released = 0
+        if reserved:
+            result = await db.spots.bulk_write(
+                [
+                    UpdateOne(
+                        {"id": spot['id'], "status": "reserved", "reserved_by": spot.get('reserved_by')},
+                        {"$set": {"status": "available"}, "$unset": {"reserved_by": ""}}
+                    )
+                    for spot in reserved
+                ],
+                ordered=False
+            )
+            released = result.modified_count
+            await settle_lot_transitions([(spot, "available") for spot in reserved], released)
+            invalidate_spots([spot['id'] for spot in reserved])
+            spot_hub.publish([{"id": spot['id'], "status": "available"} for spot in reserved])
+        return {"cancelled": len(cancelled), "completed": len(swept) - len(cancelled), "released": released}
+
+    async def run(self):
+        while True:
+            try:
+                if await shared_state.leads("reservation-sweeper", ttl=self.interval * 3):
+                    result = await self.tick()
+                    if result['cancelled'] or result['completed']:
+                        logger.info(f"Reservation sweep: {result}")
+            except Exception as e:
+                logger.error(f"Reservation sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+reservation_sweeper = ReservationSweeper(
+    hold_minutes=float(os.environ.get('PAYMENT_HOLD_MINUTES', '15')),
+    interval=float(os.environ.get('RESERVATION_SWEEP_INTERVAL', '30'))
+)
+
 # ============ SEED DATA ============
 
-@api_router.post("/seed-data")
+@api_router.post("/seed-data", dependencies=[rate_limited("seed-data")])
 async def seed_data():
     """Initialize database with sample data"""
     
@@ -578,19 +2761,63 @@ async def seed_data():
         }
         for i in range(20)
     ]
+    for spot in sample_spots:
+        spot['geo'] = geo_point(spot['location'])
     
     await db.spots.insert_many(sample_spots)
+    await rebuild_lot_stats()
+    pricing.invalidate_catalog()
+    await pricing.refresh()
+    invalidate_spots()
+    spot_hub.resync()
     
     return {"message": "Database seeded successfully", "spots_created": len(sample_spots)}
 
 app.include_router(api_router)
 
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    stats = RequestStats()
+    token = current_request_stats.set(stats)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_request_stats.reset(token)
+    elapsed = time.perf_counter() - started
+    
+    route = request.scope.get('route')
+    path = route.path if route else "unmatched"
+    labels = (request.method, path)
+    REQUEST_SECONDS.observe(labels, elapsed)
+    REQUEST_DB_SECONDS.observe(labels, stats.db_seconds)
+    REQUEST_ROUNDTRIPS.observe(labels, stats.commands)
+    for (collection, command), count in stats.by_command.items():
+        MONGO_COMMANDS.inc((path, collection, command), count)
+    MONGO_DOCS.inc((path,), stats.docs_returned)
+    
+    if stats.commands > ROUNDTRIP_BUDGET:
+        logger.warning(
+            f"{request.method} {path} made {stats.commands} Mongo round-trips "
+            f"(budget {ROUNDTRIP_BUDGET}) in {elapsed * 1000:.1f}ms: {stats.by_command}"
+        )
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    lines = []
+    for metric in (REQUEST_SECONDS, REQUEST_DB_SECONDS, REQUEST_ROUNDTRIPS, MONGO_COMMANDS, MONGO_DOCS, RATE_LIMITED):
+        lines += metric.render()
+    lines += session_cache.render()
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Before", "X-Next-Cursor", "X-Truncated"],
 )
 
 logging.basicConfig(
@@ -599,6 +2826,231 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+# ============ INDEXES ============
+
+# (keys, options) per collection, matching the filters/sorts used above
+INDEXES = {
+    "user_sessions": [
+        ([("session_token", 1)], {"unique": True}),
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "users": [
+        ([("id", 1)], {"unique": True}),
+        ([("email", 1)], {"unique": True}),
+    ],
+    "spots": [
+        ([("id", 1)], {"unique": True}),
+        ([("status", 1), ("ev_charging", 1)], {}),
+        ([("lot_id", 1), ("status", 1)], {}),
+        ([("geo", "2dsphere")], {}),
+    ],
+    "bookings": [
+        ([("id", 1)], {"unique": True}),
+        ([("user_id", 1), ("created_at", -1)], {}),
+        ([("status", 1), ("created_at", 1)], {}),
+        ([("status", 1), ("end_time", 1)], {}),
+    ],
+    "transactions": [
+        ([("booking_id", 1)], {}),
+        ([("id", 1)], {"unique": True}),
+        ([("razorpay_order_id", 1)], {}),
+        ([("settlement_id", 1)], {"sparse": True}),
+        ([("user_id", 1), ("created_at", -1)], {}),
+    ],
+    "rewards": [
+        ([("user_id", 1)], {"unique": True}),
+        ([("points", -1)], {}),
+    ],
+    "lot_stats": [
+        ([("lot_id", 1)], {"unique": True}),
+    ],
+    "sensor_buckets": [
+        ([("spot_id", 1), ("hour", 1)], {"unique": True}),
+        ([("hour", 1)], {"expireAfterSeconds": SENSOR_RETENTION_DAYS * 24 * 3600}),
+    ],
+    "lot_occupancy_hourly": [
+        ([("lot_id", 1), ("hour", -1)], {"unique": True}),
+        ([("complete", 1), ("hour", 1)], {}),
+    ],
+    "shared_spaces": [
+        ([("available", 1), ("created_at", -1), ("id", -1)], {}),
+        ([("available", 1), ("slot_type", 1), ("created_at", -1), ("id", -1)], {}),
+        ([("available", 1), ("rate_per_hour", 1), ("id", 1)], {}),
+        ([("available", 1), ("slot_type", 1), ("rate_per_hour", 1), ("id", 1)], {}),
+        ([("owner_id", 1), ("created_at", -1), ("id", -1)], {}),
+        ([("geo", "2dsphere")], {}),
+    ],
+}
+
+# (collection, filter, sort) for the queries that must never COLLSCAN
+HOT_QUERIES = [
+    ("user_sessions", {"session_token": ""}, None),
+    ("users", {"id": ""}, None),
+    ("users", {"email": ""}, None),
+    ("spots", {"id": ""}, None),
+    ("spots", {"status": "available", "ev_charging": True}, None),
+    ("bookings", {"user_id": ""}, [("created_at", -1)]),
+    ("transactions", {"booking_id": ""}, None),
+    ("transactions", {"razorpay_order_id": ""}, None),
+    ("transactions", {"user_id": ""}, [("created_at", -1)]),
+    ("rewards", {"user_id": ""}, None),
+    ("rewards", {}, [("points", -1)]),
+    ("shared_spaces", {"available": True}, None),
+    ("shared_spaces", {"available": True}, [("created_at", -1), ("id", -1)]),
+    ("shared_spaces", {"available": True, "slot_type": ""}, [("rate_per_hour", 1), ("id", 1)]),
+    ("shared_spaces", {"owner_id": ""}, [("created_at", -1), ("id", -1)]),
+    ("sensor_buckets", {"hour": {"$gte": datetime(2024, 1, 1, tzinfo=timezone.utc)}}, None),
+    ("lot_occupancy_hourly", {"lot_id": ""}, [("hour", -1)]),
+    ("lot_occupancy_hourly", {"complete": True}, [("hour", 1)]),
+    ("spots", {"geo": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [77.2090, 28.6139]}}}}, None),
+]
+
+async def migrate_geo_points():
+    """Backfill the GeoJSON geo field on documents written before it existed"""
+    for collection in ("spots", "shared_spaces"):
+        result = await db[collection].update_many(
+            {
+                "geo": {"$exists": False},
+                "location.lat": {"$type": "number"},
+                "location.lng": {"$type": "number"}
+            },
+            [{"$set": {"geo": {"type": "Point", "coordinates": ["$location.lng", "$location.lat"]}}}]
+        )
+        if result.modified_count:
+            logger.info(f"Backfilled geo on {result.modified_count} {collection} documents")
+
+async def migrate_session_expiry(batch: int = 1000):
+    """Convert ISO string expires_at on older sessions to dates the TTL index can reap"""
+    writes, converted = [], 0
+    async for session in db.user_sessions.find({"expires_at": {"$type": "string"}}, {"_id": 1, "expires_at": 1}):
+        expires_at = parse_timestamp(session['expires_at'])
+        if expires_at is None:
+            continue
+        writes.append(UpdateOne({"_id": session['_id']}, {"$set": {"expires_at": expires_at}}))
+        if len(writes) >= batch:
+            await db.user_sessions.bulk_write(writes, ordered=False)
+            converted, writes = converted + len(writes), []
+    if writes:
+        await db.user_sessions.bulk_write(writes, ordered=False)
+        converted += len(writes)
+    if converted:
+        logger.info(f"Converted expires_at on {converted} sessions to dates")
+
+async def migrate_reward_summaries(batch: int = 1000):
+    """Backfill balance, level and recent transactions on pre-summary reward docs"""
+    async def flush(user_ids: List[str]) -> int:
+        recent = {user_id: [] for user_id in user_ids}
+        async for transaction in db.transactions.find(
+            {"user_id": {"$in": user_ids}}, {"_id": 0, "id": 1, "user_id": 1}
+        ).sort("created_at", -1):
+            ids = recent[transaction['user_id']]
+            if len(ids) < RECENT_TRANSACTIONS:
+                ids.append(transaction['id'])
+        await db.rewards.bulk_write([
+            UpdateOne({"user_id": user_id}, [{"$set": {"recent_transaction_ids": ids}}, DERIVED_SUMMARY])
+            for user_id, ids in recent.items()
+        ], ordered=False)
+        return len(user_ids)
+    
+    user_ids, migrated = [], 0
+    async for reward in db.rewards.find({"balance": {"$exists": False}}, {"_id": 0, "user_id": 1}):
+        user_ids.append(reward['user_id'])
+        if len(user_ids) >= batch:
+            migrated, user_ids = migrated + await flush(user_ids), []
+    if user_ids:
+        migrated += await flush(user_ids)
+    if migrated:
+        logger.info(f"Backfilled summaries on {migrated} reward documents")
+
+async def migrate_sensor_events(batch: int = 5000):
+    """Fold the legacy one-document-per-reading sensor_events into hourly buckets"""
+    if "sensor_events" not in await db.list_collection_names():
+        return
+    spots = await db.spots.find({}, {"_id": 0, "id": 1, "lot_id": 1}).to_list(None)
+    lot_of = {spot['id']: spot.get('lot_id') for spot in spots}
+    readings, migrated = [], 0
+    
+    async def flush():
+        writes = bucket_writes(readings, lot_of)
+        if writes:
+            await db.sensor_buckets.bulk_write(writes, ordered=False)
+    
+    async for event in db.sensor_events.find({}, {"_id": 0}).sort("_id", 1).batch_size(batch):
+        if event.get('status') in STATUS_CODES and isinstance(event.get('timestamp'), str):
+            readings.append(event)
+        if len(readings) >= batch:
+            await flush()
+            migrated, readings = migrated + len(readings), []
+    await flush()
+    migrated += len(readings)
+    await db.sensor_events.drop()
+    logger.info(f"Moved {migrated} sensor_events into hourly buckets")
+
+async def ensure_indexes():
+    """Create every declared index; create_index is a no-op if it already exists"""
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                logger.error(f"Index {collection}.{keys} not created: {e}")
+
+def _plan_stages(plan: dict):
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+async def check_query_plans() -> List[dict]:
+    """explain() each hot query and report the ones still doing a COLLSCAN"""
+    report = []
+    for collection, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = list(_plan_stages(explain['queryPlanner']['winningPlan']))
+        if 'COLLSCAN' in stages:
+            report.append({"collection": collection, "filter": query, "sort": sort, "stages": stages})
+    return report
+
+async def bootstrap_indexes():
+    await migrate_geo_points()
+    await migrate_session_expiry()
+    await migrate_reward_summaries()
+    await migrate_sensor_events()
+    if not await db.lot_stats.find_one({}, {"_id": 1}):
+        await rebuild_lot_stats()
+    await ensure_indexes()
+    if os.environ.get('INDEX_SELF_CHECK', '').lower() in ('1', 'true', 'yes'):
+        for entry in await check_query_plans():
+            logger.warning(f"COLLSCAN on {entry['collection']} for {entry['filter']} sort={entry['sort']}")
+
+async def on_startup():
+    await shared_state.start()
+    if int(os.environ.get('WEB_CONCURRENCY', '1')) > 1 and isinstance(shared_state.backend, MemoryStateBackend):
+        logger.warning("Running several workers with STATE_BACKEND=memory; caches and spot streams won't agree")
+    # Migrations must not run twice concurrently; workers starting alongside skip them
+    if await shared_state.leads("bootstrap", ttl=600):
+        try:
+            await bootstrap_indexes()
+        finally:
+            await shared_state.backend.release_lease("bootstrap")
+    sensor_ingestor.start()
+    app.state.tasks = [
+        asyncio.create_task(forecaster.run(float(os.environ.get('FORECAST_RETRAIN_INTERVAL', '300')))),
+        asyncio.create_task(sensor_rollup.run()),
+        asyncio.create_task(pricing.run(PRICING_INTERVAL)),
+        asyncio.create_task(reservation_sweeper.run()),
+    ]
+
+async def on_shutdown():
+    for task in app.state.tasks:
+        task.cancel()
+    forecaster.close()
+    await sensor_ingestor.stop()
+    await auth_upstream.close()
+    await shared_state.close()
+    client.close()
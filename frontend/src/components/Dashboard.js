@@ -62,7 +62,7 @@ const Dashboard = ({ user, onLogout }) => {
       <div className="flex justify-between items-start mb-3">
         <div>
           <div className="font-semibold text-[#212121] mb-1">Slot {spot.slot_number}</div>
-          <div className="text-sm text-[#616161]">₹{spot.rate_per_hour}/hr</div>
+          <div className="text-sm text-[#616161]">₹{spot.current_rate ?? spot.rate_per_hour}/hr</div>
         </div>
         <span
           className={`px-3 py-1 rounded-full text-xs font-medium ${
@@ -14,7 +14,42 @@ const MapView = ({ user, onLogout }) => {
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    loadSpots();
+    if (typeof EventSource === 'undefined') {
+      loadSpots();
+      return;
+    }
+
+    const source = new EventSource(`${axiosInstance.defaults.baseURL}/spots/stream`, {
+      withCredentials: true
+    });
+
+    source.addEventListener('snapshot', (event) => {
+      setSpots(JSON.parse(event.data));
+      setLoading(false);
+    });
+
+    source.addEventListener('snapshot_page', (event) => {
+      const page = JSON.parse(event.data);
+      setSpots(prev => prev.concat(page));
+    });
+
+    source.addEventListener('delta', (event) => {
+      const changes = new Map(JSON.parse(event.data).map(d => [d.id, d.status]));
+      setSpots(prev => prev.map(s => (changes.has(s.id) ? { ...s, status: changes.get(s.id) } : s)));
+    });
+
+    source.addEventListener('rates', (event) => {
+      const rates = JSON.parse(event.data);
+      setSpots(prev => prev.map(s => (s.id in rates ? { ...s, current_rate: rates[s.id] } : s)));
+    });
+
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        loadSpots();
+      }
+    };
+
+    return () => source.close();
   }, []);
 
   useEffect(() => {
@@ -51,7 +86,9 @@ const MapView = ({ user, onLogout }) => {
   const refreshSpots = async () => {
     try {
       await axiosInstance.post('/simulate-iot');
-      await loadSpots();
+      if (typeof EventSource === 'undefined') {
+        await loadSpots();
+      }
       toast.success('Map refreshed with latest data');
     } catch (error) {
       toast.error('Failed to refresh map');
@@ -77,7 +114,7 @@ const MapView = ({ user, onLogout }) => {
       <div className="flex justify-between items-start mb-2">
         <div>
           <div className="font-semibold text-[#212121] mb-1">Slot {spot.slot_number}</div>
-          <div className="text-sm text-[#616161]">₹{spot.rate_per_hour}/hr</div>
+          <div className="text-sm text-[#616161]">₹{spot.current_rate ?? spot.rate_per_hour}/hr</div>
         </div>
         <span
           className={`px-3 py-1 rounded-full text-xs font-medium ${
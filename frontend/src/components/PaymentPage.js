@@ -181,7 +181,7 @@ const PaymentPage = ({ user, onLogout }) => {
                 </div>
                 <div className="flex justify-between">
                   <span className="text-[#616161]">Rate</span>
-                  <span className="font-medium text-[#212121]">₹{spot?.rate_per_hour}/hr</span>
+                  <span className="font-medium text-[#212121]">₹{booking?.rate_per_hour ?? spot?.rate_per_hour}/hr</span>
                 </div>
                 {booking?.ev_charging && (
                   <div className="flex justify-between text-[#43A047]">
@@ -25,9 +25,15 @@ const PredictPage = ({ user, onLogout }) => {
 
     setLoading(true);
     try {
-      const response = await axiosInstance.post('/predict-availability', formData);
+      // datetime-local has no timezone; send the instant it means in local time
+      const response = await axiosInstance.post('/predict-availability', {
+        ...formData,
+        arrival_time: new Date(formData.arrival_time).toISOString()
+      });
       setPrediction(response.data);
-      toast.success('Prediction generated successfully');
+      if (response.data.trained) {
+        toast.success('Prediction generated successfully');
+      }
     } catch (error) {
       toast.error('Failed to generate prediction');
     } finally {
@@ -110,7 +116,12 @@ const PredictPage = ({ user, onLogout }) => {
           </div>
 
           <div className="space-y-6">
-            {prediction ? (
+            {prediction && !prediction.trained ? (
+              <div className="bg-white rounded-2xl p-12 shadow-lg text-center">
+                <BarChart3 className="w-16 h-16 text-[#1976D2] mx-auto mb-4 opacity-50" />
+                <div className="text-[#616161]">{prediction.message}</div>
+              </div>
+            ) : prediction ? (
               <>
                 <div className="bg-gradient-to-br from-[#1976D2] to-[#1565C0] rounded-2xl p-6 text-white shadow-lg">
                   <div className="flex items-center justify-between mb-4">
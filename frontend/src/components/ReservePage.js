@@ -32,7 +32,7 @@ const ReservePage = ({ user, onLogout }) => {
 
   const calculateTotal = () => {
     if (!spot) return 0;
-    const baseAmount = spot.rate_per_hour * duration;
+    const baseAmount = (spot.current_rate ?? spot.rate_per_hour) * duration;
     const evCharge = evCharging ? 50 : 0;
     return baseAmount + evCharge;
   };
@@ -93,8 +93,8 @@ const ReservePage = ({ user, onLogout }) => {
 
               <div className="grid sm:grid-cols-2 gap-4 mb-6">
                 <div className="bg-[#F4F6F8] rounded-xl p-4">
-                  <div className="text-sm text-[#616161] mb-1">Base Rate</div>
-                  <div className="text-2xl font-bold text-[#212121]">₹{spot?.rate_per_hour}/hr</div>
+                  <div className="text-sm text-[#616161] mb-1">Current Rate</div>
+                  <div className="text-2xl font-bold text-[#212121]">₹{spot?.current_rate ?? spot?.rate_per_hour}/hr</div>
                 </div>
                 <div className="bg-[#F4F6F8] rounded-xl p-4">
                   <div className="text-sm text-[#616161] mb-1">Distance</div>
@@ -166,7 +166,7 @@ const ReservePage = ({ user, onLogout }) => {
               <div className="space-y-3 mb-6">
                 <div className="flex justify-between text-[#616161]">
                   <span>Parking ({duration}h)</span>
-                  <span>₹{spot?.rate_per_hour * duration}</span>
+                  <span>₹{(spot?.current_rate ?? spot?.rate_per_hour) * duration}</span>
                 </div>
                 {evCharging && (
                   <div className="flex justify-between text-[#43A047]">
@@ -59,7 +59,10 @@ const RewardsPage = ({ user, onLogout }) => {
     );
   }
 
-  const monthlyData = [
+  const monthlyData = rewards?.monthly_carbon?.length ? rewards.monthly_carbon.slice(-6).map(m => ({
+    month: new Date(`${m.month}-01T00:00:00`).toLocaleString('en', { month: 'short' }),
+    carbon: Math.round(m.carbon * 100) / 100
+  })) : [
     { month: 'Jan', carbon: 2.5 },
     { month: 'Feb', carbon: 3.2 },
     { month: 'Mar', carbon: 2.8 },
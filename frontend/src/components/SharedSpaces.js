@@ -8,6 +8,9 @@ const SharedSpaces = ({ user, onLogout }) => {
   const [spaces, setSpaces] = useState([]);
   const [loading, setLoading] = useState(true);
   const [showAddForm, setShowAddForm] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [filters, setFilters] = useState({ slot_type: '', sort: 'newest' });
+  const [showMine, setShowMine] = useState(false);
   const [formData, setFormData] = useState({
     name: '',
     location: { lat: 28.6139, lng: 77.2090 },
@@ -17,12 +20,16 @@ const SharedSpaces = ({ user, onLogout }) => {
 
   useEffect(() => {
     loadSharedSpaces();
-  }, []);
+  }, [filters, showMine]);
 
-  const loadSharedSpaces = async () => {
+  const loadSharedSpaces = async (cursor = null) => {
     try {
-      const response = await axiosInstance.get('/shared-spaces');
-      setSpaces(response.data);
+      const params = showMine ? {} : { sort: filters.sort };
+      if (!showMine && filters.slot_type) params.slot_type = filters.slot_type;
+      if (cursor) params.cursor = cursor;
+      const response = await axiosInstance.get(showMine ? '/shared-spaces/mine' : '/shared-spaces/search', { params });
+      setSpaces(cursor ? [...spaces, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       toast.error('Failed to load shared spaces');
     } finally {
@@ -142,6 +149,38 @@ const SharedSpaces = ({ user, onLogout }) => {
           </div>
         )}
 
+        <div className="flex flex-wrap gap-4 mb-6">
+          <select
+            data-testid="space-filter-type"
+            value={filters.slot_type}
+            disabled={showMine}
+            onChange={(e) => setFilters({ ...filters, slot_type: e.target.value })}
+            className="px-4 py-2 border border-[#E0E0E0] rounded-xl bg-white focus:outline-none focus:ring-2 focus:ring-[#1976D2]"
+          >
+            <option value="">All types</option>
+            <option value="regular">Regular</option>
+            <option value="covered">Covered</option>
+            <option value="ev_charging">EV Charging</option>
+          </select>
+          <select
+            data-testid="space-sort"
+            value={filters.sort}
+            disabled={showMine}
+            onChange={(e) => setFilters({ ...filters, sort: e.target.value })}
+            className="px-4 py-2 border border-[#E0E0E0] rounded-xl bg-white focus:outline-none focus:ring-2 focus:ring-[#1976D2]"
+          >
+            <option value="newest">Newest</option>
+            <option value="price">Lowest price</option>
+          </select>
+          <button
+            data-testid="my-spaces-btn"
+            onClick={() => setShowMine(!showMine)}
+            className={`px-4 py-2 rounded-xl font-medium transition ${showMine ? 'bg-[#1976D2] text-white' : 'bg-white text-[#1976D2] border border-[#1976D2]'}`}
+          >
+            My Listings
+          </button>
+        </div>
+
         {spaces.length === 0 ? (
           <div className="bg-white rounded-2xl p-12 shadow-lg text-center">
             <Share2 className="w-16 h-16 text-[#1976D2] mx-auto mb-4 opacity-50" />
@@ -174,7 +213,7 @@ const SharedSpaces = ({ user, onLogout }) => {
                   </div>
                   <div className="flex items-center gap-2 text-[#616161] mb-4">
                     <Navigation className="w-4 h-4" />
-                    <span className="text-sm">{Math.floor(Math.random() * 500 + 100)}m away</span>
+                    <span className="text-sm">{space.distance_m != null ? Math.round(space.distance_m) : Math.floor(Math.random() * 500 + 100)}m away</span>
                   </div>
                   <div className="flex items-center justify-between pt-4 border-t border-[#E0E0E0]">
                     <div className="flex items-center gap-1">
@@ -191,6 +230,18 @@ const SharedSpaces = ({ user, onLogout }) => {
             ))}
           </div>
         )}
+
+        {nextCursor && (
+          <div className="flex justify-center mt-8">
+            <button
+              data-testid="load-more-spaces-btn"
+              onClick={() => loadSharedSpaces(nextCursor)}
+              className="px-6 py-3 bg-white text-[#1976D2] border border-[#1976D2] rounded-xl font-semibold hover:bg-[#E3F2FD] transition"
+            >
+              Load more
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
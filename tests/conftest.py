@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py reads MONGO_URL at import; tests swap in mongomock before any query
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'greenpark_test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
@@ -0,0 +1,40 @@
+"""Shared setup for tests that drive the app against mongomock"""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+async def fresh_db():
+    """Point the app at an empty mongomock database and reset per-process state"""
+    server.db = AsyncMongoMockClient()['greenpark_test']
+    server.shared_state.backend = server.MemoryStateBackend()
+    server.session_cache._entries.clear()
+    server.response_cache._entries.clear()
+    await server.ensure_indexes()
+
+
+async def make_user(name: str = "user") -> tuple:
+    """Insert a user with a live session and rewards; return (user_id, auth headers)"""
+    now = datetime.now(timezone.utc)
+    user_id, token = str(uuid.uuid4()), f"test_{uuid.uuid4().hex}"
+    await server.db.users.insert_one({"id": user_id, "email": f"{name}-{user_id}@test.local", "name": name, "created_at": now.isoformat()})
+    await server.db.user_sessions.insert_one({"user_id": user_id, "session_token": token, "expires_at": now + timedelta(days=1)})
+    await server.db.rewards.insert_one(server.Reward(user_id=user_id).model_dump())
+    return user_id, {"Authorization": f"Bearer {token}"}
+
+
+async def make_spot(lot_id: str = "lot_001", rate: float = 40) -> str:
+    spot_id = str(uuid.uuid4())
+    await server.db.spots.insert_one({
+        "id": spot_id, "lot_id": lot_id, "slot_number": "A1", "status": "available",
+        "ev_charging": False, "location": {"lat": 28.6139, "lng": 77.2090}, "rate_per_hour": rate
+    })
+    return spot_id
+
+
+def api_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test")
@@ -0,0 +1,27 @@
+import asyncio
+
+import server
+from .support import api_client, fresh_db, make_spot, make_user
+
+
+async def contend_for_one_spot(clients: int) -> tuple:
+    await fresh_db()
+    headers = [(await make_user(f"user{i}"))[1] for i in range(clients)]
+    spot_id = await make_spot()
+
+    async with api_client() as client:
+        responses = await asyncio.gather(*[
+            client.post("/api/bookings", json={"spot_id": spot_id, "duration_hours": 1}, headers=h)
+            for h in headers
+        ])
+    spot = await server.db.spots.find_one({"id": spot_id})
+    stored = await server.db.bookings.count_documents({"spot_id": spot_id})
+    return [r.status_code for r in responses], spot['status'], stored
+
+
+def test_contended_booking_has_exactly_one_winner():
+    statuses, spot_status, stored = asyncio.run(contend_for_one_spot(20))
+    assert statuses.count(200) == 1
+    assert set(statuses) == {200, 400}
+    assert spot_status == "reserved"
+    assert stored == 1
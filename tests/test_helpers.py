@@ -0,0 +1,111 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+# ============ TOKEN BUCKET ============
+
+def test_new_bucket_starts_full():
+    tokens, wait = server.take_from_bucket(None, 100.0, rate=1.0, burst=3)
+    assert (tokens, wait) == (2, 0.0)
+
+
+def test_empty_bucket_reports_wait_until_next_token():
+    state = (0.5, 100.0)
+    tokens, wait = server.take_from_bucket(state, 100.0, rate=0.5, burst=3)
+    assert tokens == 0.5
+    assert wait == pytest.approx(1.0)
+
+
+def test_bucket_refills_up_to_burst():
+    tokens, wait = server.take_from_bucket((0.0, 0.0), 1000.0, rate=1.0, burst=3)
+    assert (tokens, wait) == (2, 0.0)
+
+
+# ============ CURSORS ============
+
+def test_cursor_round_trip():
+    cursor = server.encode_cursor("price", [40, "abc"])
+    assert server.decode_cursor(cursor, "price") == [40, "abc"]
+
+
+@pytest.mark.parametrize("values", [["40", "abc"], [{"$gt": 0}, "abc"], [True, "abc"], [40]])
+def test_cursor_rejects_wrong_value_types(values):
+    with pytest.raises(HTTPException) as error:
+        server.decode_cursor(server.encode_cursor("price", values), "price")
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("cursor", ["NQ", "!!!", server.encode_cursor("newest", ["2024-01-01", "a"])])
+def test_cursor_rejects_malformed_or_foreign_cursors(cursor):
+    with pytest.raises(HTTPException) as error:
+        server.decode_cursor(cursor, "price")
+    assert error.value.status_code == 400
+
+
+def test_keyset_filter_follows_sort_direction():
+    assert server.keyset_filter("newest", ["2024-01-01", "b"]) == {"$or": [
+        {"created_at": {"$lt": "2024-01-01"}},
+        {"created_at": "2024-01-01", "id": {"$lt": "b"}}
+    ]}
+    assert server.keyset_filter("price", [40, "b"]) == {"$or": [
+        {"rate_per_hour": {"$gt": 40}},
+        {"rate_per_hour": 40, "id": {"$gt": "b"}}
+    ]}
+
+
+# ============ LOT COUNTERS ============
+
+def test_lot_transition_moves_one_spot_between_statuses():
+    spot = {"status": "occupied", "ev_charging": False}
+    assert server.lot_transition(spot, "reserved") == {"occupied": -1, "reserved": 1}
+
+
+def test_lot_transition_tracks_ev_availability():
+    spot = {"status": "available", "ev_charging": True}
+    assert server.lot_transition(spot, "reserved") == {"available": -1, "reserved": 1, "ev_available": -1}
+    spot = {"status": "reserved", "ev_charging": True}
+    assert server.lot_transition(spot, "available")["ev_available"] == 1
+
+
+def test_sensor_readings_only_move_a_reservation_to_occupied():
+    assert server.sensor_transition("reserved", "occupied")
+    assert not server.sensor_transition("reserved", "available")
+    assert not server.sensor_transition("reserved", "soon_available")
+    assert server.sensor_transition("occupied", "available")
+    assert not server.sensor_transition("available", "available")
+
+
+# ============ PRICING ============
+
+def test_surge_multipliers_span_min_to_max():
+    multipliers = server.surge_multipliers(np.array([-0.5, 0.0, server.SURGE_THRESHOLD, 1.0, 1.5]))
+    assert multipliers.tolist() == pytest.approx(
+        [server.SURGE_MIN, server.SURGE_MIN, 1.0, server.SURGE_MAX, server.SURGE_MAX]
+    )
+
+
+def test_surge_multipliers_rise_with_demand():
+    multipliers = server.surge_multipliers(np.linspace(0, 1, 21))
+    assert np.all(np.diff(multipliers) >= 0)
+
+
+# ============ SENSOR BUCKETS ============
+
+def test_bucket_readings_packs_offset_and_status_per_hour():
+    readings = [
+        {"spot_id": "s1", "status": "occupied", "timestamp": "2024-01-01T10:01:05+00:00"},
+        {"spot_id": "s1", "status": "available", "timestamp": "2024-01-01T15:32:00+05:30"},
+        {"spot_id": "s1", "status": "available", "timestamp": datetime(2024, 1, 1, 11, 0, tzinfo=timezone.utc)},
+        {"spot_id": "s2", "status": "available", "timestamp": "not a time"},
+    ]
+    codes = len(server.SPOT_STATUSES)
+    hour = lambda h: datetime(2024, 1, 1, h, tzinfo=timezone.utc)
+    assert server.bucket_readings(readings) == {
+        ("s1", hour(10)): [65 * codes + server.STATUS_CODES["occupied"], 120 * codes + server.STATUS_CODES["available"]],
+        ("s1", hour(11)): [server.STATUS_CODES["available"]],
+    }
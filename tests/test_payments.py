@@ -0,0 +1,101 @@
+import asyncio
+
+import server
+from .support import api_client, fresh_db, make_spot, make_user
+
+SECRET = "test-webhook-secret"
+
+
+async def pending_order(client, headers) -> tuple:
+    """(booking, order) for a fresh reservation awaiting payment"""
+    spot_id = await make_spot()
+    booking = (await client.post("/api/bookings", json={"spot_id": spot_id, "duration_hours": 1}, headers=headers)).json()
+    order = (await client.post("/api/payments/create-order", json={"booking_id": booking['id']}, headers=headers)).json()
+    return booking, order
+
+
+async def points(user_id: str) -> int:
+    return (await server.db.rewards.find_one({"user_id": user_id}))['points']
+
+
+def test_replayed_verification_returns_the_original_award():
+    async def scenario():
+        await fresh_db()
+        user_id, headers = await make_user()
+        async with api_client() as client:
+            booking, order = await pending_order(client, headers)
+            body = {"razorpay_payment_id": "pay_1", "razorpay_order_id": order['order_id'], "booking_id": booking['id']}
+            first = await client.post("/api/payments/verify", json=body, headers=headers)
+            replay = await client.post("/api/payments/verify", json=body, headers=headers)
+            other = await client.post("/api/payments/verify", json={**body, "razorpay_payment_id": "pay_2"}, headers=headers)
+        return first, replay, other, await points(user_id)
+
+    first, replay, other, total = asyncio.run(scenario())
+    assert first.status_code == replay.status_code == 200
+    assert replay.json()['replayed'] is True
+    assert replay.json()['points_earned'] == first.json()['points_earned'] == total
+    assert other.status_code == 409
+
+
+def test_replay_finishes_a_settlement_that_stopped_after_the_claim():
+    async def scenario():
+        await fresh_db()
+        user_id, headers = await make_user()
+        async with api_client() as client:
+            booking, order = await pending_order(client, headers)
+            # The claim landed but the process died before the booking and reward writes
+            await server.db.transactions.update_one(
+                {"razorpay_order_id": order['order_id']},
+                {"$set": server.settlement("pay_1", 20, 1.5, "settle_1")}
+            )
+            body = {"razorpay_payment_id": "pay_1", "razorpay_order_id": order['order_id'], "booking_id": booking['id']}
+            replays = [await client.post("/api/payments/verify", json=body, headers=headers) for _ in range(2)]
+        stored = await server.db.bookings.find_one({"id": booking['id']})
+        transaction = await server.db.transactions.find_one({"razorpay_order_id": order['order_id']})
+        return replays, stored, transaction, await points(user_id)
+
+    replays, booking, transaction, total = asyncio.run(scenario())
+    assert [r.status_code for r in replays] == [200, 200]
+    assert booking['status'] == "active"
+    assert transaction['booking_activated'] and transaction['rewarded']
+    assert total == 20
+
+
+def test_reconcile_settles_one_order_per_booking_and_is_safe_to_resend(monkeypatch):
+    monkeypatch.setenv("PAYMENT_WEBHOOK_SECRET", SECRET)
+
+    async def scenario():
+        await fresh_db()
+        user_id, headers = await make_user()
+        async with api_client() as client:
+            booking, first = await pending_order(client, headers)
+            second = (await client.post("/api/payments/create-order", json={"booking_id": booking['id']}, headers=headers)).json()
+            batch = {"payments": [
+                {"razorpay_order_id": first['order_id'], "razorpay_payment_id": "pay_a"},
+                {"razorpay_order_id": second['order_id'], "razorpay_payment_id": "pay_b"}
+            ]}
+            result = (await client.post("/api/payments/reconcile", json=batch, headers={"X-Webhook-Secret": SECRET})).json()
+            awarded = await points(user_id)
+            resent = (await client.post("/api/payments/reconcile", json=batch, headers={"X-Webhook-Secret": SECRET})).json()
+        statuses = {t['razorpay_order_id']: t['status'] async for t in server.db.transactions.find({})}
+        stored = await server.db.bookings.find_one({"id": booking['id']})
+        return result, resent, statuses, stored, awarded, await points(user_id)
+
+    result, resent, statuses, booking, awarded, total = asyncio.run(scenario())
+    assert result['settled'] == 1
+    assert sorted(statuses.values()) == ["completed", "refund_due"]
+    assert booking['status'] == "active"
+    assert resent['settled'] == 0
+    assert len(resent['duplicates']) == 1
+    assert awarded > 0 and total == awarded
+
+
+def test_reconcile_requires_the_webhook_secret(monkeypatch):
+    monkeypatch.setenv("PAYMENT_WEBHOOK_SECRET", SECRET)
+
+    async def scenario():
+        await fresh_db()
+        async with api_client() as client:
+            return await client.post("/api/payments/reconcile", json={"payments": []}, headers={"X-Webhook-Secret": "wrong"})
+
+    assert asyncio.run(scenario()).status_code == 401
@@ -0,0 +1,34 @@
+import asyncio
+
+import server
+from .support import api_client, fresh_db
+
+PREDICTION = {"destination": "lot_001", "arrival_time": "2026-05-01T09:00:00+05:30", "duration": 1}
+
+
+def test_exhausted_bucket_answers_429_with_retry_after(monkeypatch):
+    monkeypatch.setitem(server.rate_limiter.limits, "predictions", (6, 2))
+
+    async def scenario():
+        await fresh_db()
+        async with api_client() as client:
+            return [await client.post("/api/predict-availability", json=PREDICTION) for _ in range(3)]
+
+    responses = asyncio.run(scenario())
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    # 6 a minute refills one token every 10 seconds
+    assert responses[-1].headers['Retry-After'] == "10"
+
+
+def test_login_limit_applies_before_the_session_exchange(monkeypatch):
+    monkeypatch.setitem(server.rate_limiter.limits, "login", (6, 1))
+
+    async def scenario():
+        await fresh_db()
+        async with api_client() as client:
+            # No X-Session-ID, so nothing reaches the auth upstream
+            return [await client.post("/api/auth/session-data") for _ in range(2)]
+
+    responses = asyncio.run(scenario())
+    assert [r.status_code for r in responses] == [400, 429]
+    assert responses[-1].headers['Retry-After'] == "10"
@@ -0,0 +1,37 @@
+import asyncio
+
+from .support import api_client, fresh_db, make_spot, make_user
+
+
+def test_unchanged_spot_list_revalidates_with_304():
+    async def scenario():
+        await fresh_db()
+        await make_spot()
+        async with api_client() as client:
+            first = await client.get("/api/spots")
+            again = await client.get("/api/spots", headers={"If-None-Match": first.headers['ETag']})
+        return first, again
+
+    first, again = asyncio.run(scenario())
+    assert first.status_code == 200
+    assert again.status_code == 304
+    assert again.headers['ETag'] == first.headers['ETag']
+
+
+def test_booking_invalidates_the_cached_spot_list_and_spot():
+    async def scenario():
+        await fresh_db()
+        _, headers = await make_user()
+        spot_id = await make_spot()
+        async with api_client() as client:
+            listing = await client.get("/api/spots")
+            spot = await client.get(f"/api/spots/{spot_id}")
+            await client.post("/api/bookings", json={"spot_id": spot_id, "duration_hours": 1}, headers=headers)
+            listing_after = await client.get("/api/spots", headers={"If-None-Match": listing.headers['ETag']})
+            spot_after = await client.get(f"/api/spots/{spot_id}", headers={"If-None-Match": spot.headers['ETag']})
+        return listing_after, spot_after
+
+    listing, spot = asyncio.run(scenario())
+    assert listing.status_code == spot.status_code == 200
+    assert listing.json()[0]['status'] == "reserved"
+    assert spot.json()['status'] == "reserved"
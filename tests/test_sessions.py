@@ -0,0 +1,32 @@
+import asyncio
+
+from .support import api_client, fresh_db, make_user
+
+
+def test_logout_drops_the_cached_session():
+    async def scenario():
+        await fresh_db()
+        _, headers = await make_user()
+        async with api_client() as client:
+            # The first lookup caches the session
+            before = await client.get("/api/auth/me", headers=headers)
+            await client.post("/api/auth/logout", headers=headers)
+            after = await client.get("/api/auth/me", headers=headers)
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before.status_code == 200
+    assert after.status_code == 401
+
+
+def test_profile_update_refreshes_the_cached_user():
+    async def scenario():
+        await fresh_db()
+        _, headers = await make_user("before")
+        async with api_client() as client:
+            await client.get("/api/auth/me", headers=headers)
+            await client.patch("/api/profile", json={"name": "after"}, headers=headers)
+            return await client.get("/api/auth/me", headers=headers)
+
+    me = asyncio.run(scenario())
+    assert me.json()['name'] == "after"
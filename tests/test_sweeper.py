@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+from .support import api_client, fresh_db, make_spot, make_user
+
+
+def past(**delta) -> str:
+    return (datetime.now(timezone.utc) - timedelta(**delta)).isoformat()
+
+
+async def book(client, headers, spot_id) -> dict:
+    response = await client.post("/api/bookings", json={"spot_id": spot_id, "duration_hours": 1}, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_completing_a_booking_leaves_the_next_holders_reservation():
+    async def scenario():
+        await fresh_db()
+        (_, x), (_, y) = await make_user("x"), await make_user("y")
+        spot_id = await make_spot()
+        async with api_client() as client:
+            booking_x = await book(client, x, spot_id)
+            await server.db.bookings.update_one({"id": booking_x['id']}, {"$set": {"status": "active"}})
+            # X parks and leaves early; the sensors free the spot and Y books it
+            await server.apply_sensor_readings([{"spot_id": spot_id, "status": "occupied", "timestamp": past(minutes=2)}])
+            await server.apply_sensor_readings([{"spot_id": spot_id, "status": "available", "timestamp": past(minutes=1)}])
+            booking_y = await book(client, y, spot_id)
+        await server.db.bookings.update_one({"id": booking_x['id']}, {"$set": {"end_time": past(minutes=1)}})
+
+        result = await server.reservation_sweeper.tick()
+        spot = await server.db.spots.find_one({"id": spot_id})
+        return result, spot, booking_y
+
+    result, spot, booking_y = asyncio.run(scenario())
+    assert result == {"cancelled": 0, "completed": 1, "released": 0}
+    assert spot['status'] == "reserved"
+    assert spot['reserved_by'] == booking_y['id']
+
+
+def test_unpaid_booking_is_cancelled_and_releases_its_spot():
+    async def scenario():
+        await fresh_db()
+        _, headers = await make_user()
+        spot_id = await make_spot()
+        async with api_client() as client:
+            booking = await book(client, headers, spot_id)
+            order = (await client.post("/api/payments/create-order", json={"booking_id": booking['id']}, headers=headers)).json()
+            await server.db.bookings.update_one({"id": booking['id']}, {"$set": {"created_at": past(hours=1)}})
+
+            result = await server.reservation_sweeper.tick()
+            verify = await client.post("/api/payments/verify", json={
+                "razorpay_payment_id": "pay_1", "razorpay_order_id": order['order_id'], "booking_id": booking['id']
+            }, headers=headers)
+        spot = await server.db.spots.find_one({"id": spot_id})
+        stored = await server.db.bookings.find_one({"id": booking['id']})
+        transaction = await server.db.transactions.find_one({"razorpay_order_id": order['order_id']})
+        return result, spot, stored, transaction, verify
+
+    result, spot, booking, transaction, verify = asyncio.run(scenario())
+    assert result == {"cancelled": 1, "completed": 0, "released": 1}
+    assert spot['status'] == "available"
+    assert "reserved_by" not in spot
+    assert booking['status'] == "cancelled"
+    assert transaction['status'] == "expired"
+    assert verify.status_code == 409